@@ -7,7 +7,7 @@ if script_dir not in sys.path:
     sys.path.append(script_dir)
 
 from database.models import BaseModel 
-from app import app, mail, local_time_to_utc_range
+from app import PREGENERATE_DRAFTS, app, mail, local_time_to_utc_range, pregenerate_drafts
 from flask_mail import Message
 
 db_model = BaseModel('Recipes') 
@@ -24,10 +24,29 @@ def send_email(to, subject, body):
         print(f"Mail error: {e}")
 
 
+# Users read per query by iter_users()
+USER_BATCH_SIZE = 500
+
+
+def iter_users(batch_size=USER_BATCH_SIZE):
+    """
+    Yield (id, timezone) rows of all users, one keyset-paged batch at a time, so memory
+    stays flat as the table grows. Each batch is read in full before its users are
+    processed: no cursor stays open while emails are sent.
+    """
+    last_id = 0
+    while True:
+        batch = user_model.run_query(
+            "SELECT id, timezone FROM Users WHERE id > %s ORDER BY id LIMIT %s", (last_id, batch_size))
+        if not batch:
+            return
+        yield from batch
+        last_id = batch[-1]['id']
+
+
 def handle_reminders_and_journals():         
     with app.app_context():
-        users = user_model.select_all()
-        for user in users:
+        for user in iter_users():
             user_id = user['id']
             user_tz = user.get('timezone') or user.get('time_zone') or 'UTC'
 
@@ -90,4 +109,7 @@ def handle_reminders_and_journals():
 
 
 if __name__ == "__main__":
-    handle_reminders_and_journals()
\ No newline at end of file
+    handle_reminders_and_journals()
+    # Tomorrow's drafts for the users now in their pre-generation hour; safe to run every time
+    if PREGENERATE_DRAFTS:
+        pregenerate_drafts()
\ No newline at end of file
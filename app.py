@@ -1,6 +1,16 @@
 from tracemalloc import start
 from urllib.parse import quote
 from database.models import BaseModel
+from database.db_connector import (init_pool, begin_request_scope, end_request_scope, has_replicas,
+                                   last_write_at, wrote_in_scope)
+from database.instrumentation import begin_request_stats, current_request_stats, end_request_stats
+from planning.catalogue import catalogue, flag_for_meal
+from planning.favorites import forget as forget_favorite_tables
+from planning.pantry import ingredient_ids_by_name, pantry_pick, rank_by_pantry
+from planning.planner import planner
+from planning.sampler import recent_recipes, sample_plan
+from shopping.items import VersionConflict, change_item, ingredient_ids_for, save_items
+from shopping.snapshot import snapshot_menus
 
 from flask import Flask, abort, flash, jsonify, render_template, redirect, url_for, request, session
 from flask_mail import Mail, Message
@@ -22,6 +32,7 @@ from reportlab.lib import colors
 from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
 
+from concurrent.futures import ThreadPoolExecutor
 import atexit
 import random
 import re
@@ -31,7 +42,23 @@ import secrets
 
 UPLOAD_FOLDER = 'static/uploads'
 
-meal_model = BaseModel('Meals')
+# Reference tables change rarely, so their query results are cached (see database/cache.py).
+# Writes in this process drop them at once; edits from other workers or setup_db.py show up
+# within the TTL, like the recipe catalogue (RECIPE_CATALOGUE_MAX_AGE)
+REFERENCE_CACHE_TTL = float(os.getenv('REFERENCE_CACHE_TTL', 300))
+# Favor high ratings and favorites and let recent recipes back in gradually (see planning.sampler)
+WEIGHTED_SAMPLING = os.getenv('WEIGHTED_SAMPLING', '1') == '1'
+# Recipes listed by the "cook from my pantry" search
+PANTRY_RESULTS = 60
+# all_day_tasks.py pre-generates tomorrow's drafts (set PREGENERATE_DRAFTS=0 to turn it off)
+PREGENERATE_DRAFTS = os.getenv('PREGENERATE_DRAFTS', '1') == '1'
+# Drafts are made during this local hour, for users with a menu in the last days
+PREGENERATE_HOUR = int(os.getenv('PREGENERATE_HOUR', 2))
+PREGENERATE_ACTIVE_DAYS = int(os.getenv('PREGENERATE_ACTIVE_DAYS', 14))
+# Drafts generated at once, each on its own pooled connection (keep below DB_POOL_SIZE)
+PREGENERATE_WORKERS = int(os.getenv('PREGENERATE_WORKERS', 2))
+
+meal_model = BaseModel('Meals', cache_ttl=REFERENCE_CACHE_TTL)
 menu_model = BaseModel('Menus')
 menu_meals_model = BaseModel('Menu_meals')
 users_model = BaseModel('Users')
@@ -39,12 +66,13 @@ recipe_model = BaseModel('Recipes')
 ing_model = BaseModel('Ingredients')
 recipe_ingredients_model = BaseModel('Recipes_Ingredients')
 favorites_recipes_model = BaseModel('User_favorite_recipes')
-recipe_categories_model = BaseModel('Recipe_categories')
-country_model = BaseModel('Countries')
-source_model = BaseModel('Data_sources')
+recipe_categories_model = BaseModel('Recipe_categories', cache_ttl=REFERENCE_CACHE_TTL)
+country_model = BaseModel('Countries', cache_ttl=REFERENCE_CACHE_TTL)
+source_model = BaseModel('Data_sources', cache_ttl=REFERENCE_CACHE_TTL)
 shopping_list_model = BaseModel('Shopping_list')
 shopping_list_items_model = BaseModel('Shopping_list_ingredients')
-units_model = BaseModel('Units')
+units_model = BaseModel('Units', cache_ttl=REFERENCE_CACHE_TTL)
+ing_categories_model = BaseModel('Ingredient_categories', cache_ttl=REFERENCE_CACHE_TTL)
 feedback_model = BaseModel('Feedback')
 
 
@@ -64,6 +92,36 @@ app.config['ADMIN_EMAIL'] = os.getenv('ADMIN_EMAIL')  # Add this line to get the
 mail = Mail(app)
 
 
+@app.before_request
+def open_db_scope():
+    # All queries of one request share a single pooled connection (per primary/replica)
+    begin_request_scope(session.get('db_last_write_at'))
+    begin_request_stats(request.endpoint)
+
+
+@app.after_request
+def remember_last_write(response):
+    # Keep this session's next reads on the primary until replicas have caught up
+    if has_replicas() and wrote_in_scope():
+        session['db_last_write_at'] = last_write_at()
+    return response
+
+
+@app.after_request
+def add_query_summary(response):
+    # In debug mode, show how many queries the request ran and how long they took
+    stats = current_request_stats()
+    if app.debug and stats:
+        response.headers['X-DB-Queries'] = stats.summary()
+    return response
+
+
+@app.teardown_request
+def close_db_scope(exc):
+    end_request_stats()
+    end_request_scope()
+
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'signin' # Where to send users if they aren't logged in
@@ -78,7 +136,7 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    u = users_model.run_query("SELECT * FROM Users WHERE id = %s", (user_id,))
+    u = users_model.run_query("SELECT * FROM Users WHERE id = %s", (user_id,), prepared=True)
     if u:
         return User(u[0])
     return None
@@ -88,91 +146,6 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 
-def consolidate_by_ingredient(rows, ingredient_densities=None):
-    """
-    rows: List of dicts from SQL (ingredient_id, measure, units, category_id)
-    ingredient_densities: Optional dict mapping ingredient_id to a specific density
-    """
-
-    unit_rows = units_model.run_query("SELECT name, category, factor FROM Units")
-    unit_metadata = {row['name'].lower().strip(): {'category': row['category'], 'factor': float(row['factor'])} for row in unit_rows}
-    
-    consolidated = {}
-    ingredient_densities = ingredient_densities or {}
-
-    for row in rows:
-        ing_id = row['ingredient_id']
-        measure = float(row['measure'])
-        unit_name = row['units'].lower().strip()
-        cat_id = row['category_id']
-        
-        if ing_id not in consolidated:
-            consolidated[ing_id] = {
-                'total_base_mass': 0.0,    # Grams
-                'total_base_volume': 0.0,  # Milliliters
-                'counts': {},              # 'pcs', 'clove', etc.
-                'category_id': cat_id      # Preserve category for UI grouping
-            }
-
-        # Look up unit details from units.csv
-        u_info = unit_metadata.get(unit_name)
-        if not u_info:
-            # If unit is unknown, treat as a Count to avoid losing data
-            consolidated[ing_id]['counts'][unit_name] = consolidated[ing_id]['counts'].get(unit_name, 0) + measure
-            continue
-
-        factor = float(u_info['factor'])
-        category = u_info['category']
-
-        if category == 'Mass':
-            consolidated[ing_id]['total_base_mass'] += measure * factor
-        elif category == 'Volume':
-            consolidated[ing_id]['total_base_volume'] += measure * factor
-        elif category == 'Count':
-            consolidated[ing_id]['counts'][unit_name] = consolidated[ing_id]['counts'].get(unit_name, 0) + measure
-        else:
-            # Handle "to serve" or other subjective units
-            consolidated[ing_id]['counts'][unit_name] = "As required"
-
-    # Final conversion step
-    final_shopping_list = []
-    for ing_id, data in consolidated.items():
-        # Get density: uses specific DB density, otherwise defaults to 1.0
-        # Defaulting to 1.0 for volume-to-mass is a safe overestimate for dry goods.
-        density = float(ingredient_densities.get(ing_id, 1.0))
-        
-        # Merge Volume into Mass: mass = volume * density
-        total_grams = data['total_base_mass'] + (data['total_base_volume'] * density)
-
-        if total_grams > 0:
-            # Choose readable unit: kg if > 1000g, otherwise g
-            if total_grams >= 1000:
-                final_shopping_list.append({
-                    'ingredient_id': ing_id,
-                    'measure': round(total_grams / 1000, 2),
-                    'units': 'kg',
-                    'category_id': data['category_id']
-                })
-            else:
-                final_shopping_list.append({
-                    'ingredient_id': ing_id,
-                    'measure': round(total_grams, 1),
-                    'units': 'g',
-                    'category_id': data['category_id']
-                })
-
-        # Add separate entries for items like "2 pcs" or "3 cloves"
-        for unit, qty in data['counts'].items():
-            final_shopping_list.append({
-                'ingredient_id': ing_id,
-                'measure': qty,
-                'units': unit,
-                'category_id': data['category_id']
-            })
-
-    return final_shopping_list
-
-
 def generate_reset_token(email):
     # Use your app's secret key to sign the token
     serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
@@ -253,13 +226,6 @@ def clean_menu_draft(user_id):
         menu_model.run_query("DELETE FROM Menus WHERE id = %s", (menu_id,))
 
 
-def match_meal_to_recipe(meal_id:int, cols)->str:
-        meal_name = meal_model.select_by_id(meal_id)['name']
-        for col in cols:
-            if meal_name.lower() in col.lower().replace('_', ' '):
-                return col
-        return None
-
 @app.route('/get_calendar_link/<int:meal_id>/<int:menu_id>')
 def get_calendar_link(meal_id, menu_id):
     try:
@@ -378,75 +344,79 @@ def fetch_recipe_form_and_update_db(operation_type:str, recipe_id=None, source_i
 
     country_name = country_model.select_by_id(country_id)['name'] if country_id else None
 
-    if operation_type == 'UPDATE':
-        new_recipe_id = recipe_id
-        # FIX 3: Removed meal_id from here because you use flags now
-        recipe_query = """
-            UPDATE Recipes
-            SET name=%s, country_id=%s, category_id=%s, n_portions=%s,
-                prep_time=%s, cooking_time=%s, instructions=%s, area=%s, thumb=%s, source_id=%s
-            WHERE id=%s
-        """
+    # Recipe row, meal flags and ingredient links are saved as one unit of work
+    with recipe_model.transaction():
+        if operation_type == 'UPDATE':
+            new_recipe_id = recipe_id
+            # FIX 3: Removed meal_id from here because you use flags now
+            recipe_query = """
+                UPDATE Recipes
+                SET name=%s, country_id=%s, category_id=%s, n_portions=%s,
+                    prep_time=%s, cooking_time=%s, instructions=%s, area=%s, thumb=%s, source_id=%s
+                WHERE id=%s
+            """
 
-        recipe_model.run_query(recipe_query, (name, country_id, cat_id, n_portions,
-                               prep_time, cooking_time, instructions, country_name,
-                               final_thumb_path, source_id, new_recipe_id))
+            recipe_model.run_query(recipe_query, (name, country_id, cat_id, n_portions,
+                                   prep_time, cooking_time, instructions, country_name,
+                                   final_thumb_path, source_id, new_recipe_id))
 
-        # FIX 2: Reset all meal flags to 0 before applying new ones
-        meal_cols = [c for c in recipe_model.columns if c.startswith('if_')]
-        for col in meal_cols:
-            recipe_model.run_query(f"UPDATE Recipes SET {col} = 0 WHERE id = %s", (new_recipe_id,))
+            # FIX 2: Reset all meal flags to 0 before applying new ones
+            meal_cols = [c for c in recipe_model.columns if c.startswith('if_')]
+            if meal_cols:
+                reset_clause = ', '.join(f"{col} = 0" for col in meal_cols)
+                recipe_model.run_query(f"UPDATE Recipes SET {reset_clause} WHERE id = %s", (new_recipe_id,))
 
-    elif operation_type == 'INSERT':
-        recipe_query = f"""
-                INSERT INTO Recipes (name, country_id, category_id, n_portions, prep_time, cooking_time, instructions, area, thumb, rating, created_by_user_id, source_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 10, %s, %s)
-            """
-        new_recipe_id = recipe_model.run_query(recipe_query, (name, country_id, cat_id, n_portions, prep_time, cooking_time, instructions, country_name, final_thumb_path, current_user.id, source_id))
+        elif operation_type == 'INSERT':
+            recipe_query = f"""
+                    INSERT INTO Recipes (name, country_id, category_id, n_portions, prep_time, cooking_time, instructions, area, thumb, rating, created_by_user_id, source_id)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 10, %s, %s)
+                """
+            new_recipe_id = recipe_model.run_query(recipe_query, (name, country_id, cat_id, n_portions, prep_time, cooking_time, instructions, country_name, final_thumb_path, current_user.id, source_id))
 
-        favorites_recipes_model.insert({
-            'user_id': current_user.id,
-            'recipe_id': new_recipe_id
-            })
-        print(f"Inserted new recipe with ID: {new_recipe_id} and added to favorites for user {current_user.id}")
+            favorites_recipes_model.insert({
+                'user_id': current_user.id,
+                'recipe_id': new_recipe_id
+                })
+            forget_favorite_tables(current_user.id)
+            print(f"Inserted new recipe with ID: {new_recipe_id} and added to favorites for user {current_user.id}")
 
-    else:
-        raise ValueError("Invalid operation type. Must be 'INSERT' or 'UPDATE'.")
+        else:
+            raise ValueError("Invalid operation type. Must be 'INSERT' or 'UPDATE'.")
 
-    # 3. Insert flags for meal types in the Recipes table
-    for meal_id in meal_ids:
-        col = match_meal_to_recipe(meal_id, recipe_model.columns)
-        if col:
-            recipe_model.run_query(f"UPDATE Recipes SET {col} = 1 WHERE id = %s", (new_recipe_id,))
+        # 3. Insert flags for meal types in the Recipes table
+        for meal_id in meal_ids:
+            col = flag_for_meal(int(meal_id))
+            if col:
+                recipe_model.run_query(f"UPDATE Recipes SET {col} = 1 WHERE id = %s", (new_recipe_id,))
 
-    # Get ingredient lists from form
-    ing_names = request.form.getlist('ing_name[]')
-    ing_measures = request.form.getlist('ing_measure[]')
-    ing_units = request.form.getlist('ing_unit[]')
-    ing_prep_notes = request.form.getlist('ing_prep_notes[]')
+        # Get ingredient lists from form
+        ing_names = request.form.getlist('ing_name[]')
+        ing_measures = request.form.getlist('ing_measure[]')
+        ing_units = request.form.getlist('ing_unit[]')
+        ing_prep_notes = request.form.getlist('ing_prep_notes[]')
 
-    # Clear existing ingredients for this recipe
-    recipe_ingredients_model.run_query("DELETE FROM Recipes_ingredients WHERE recipe_id=%s", (new_recipe_id,))
+        # Clear existing ingredients for this recipe
+        recipe_ingredients_model.run_query("DELETE FROM Recipes_ingredients WHERE recipe_id=%s", (new_recipe_id,))
 
-    for i in range(len(ing_names)):
-        name = ing_names[i].strip().title()
-        if not name: continue
+        for i in range(len(ing_names)):
+            name = ing_names[i].strip().title()
+            if not name: continue
 
-        # 1. Check if ingredient already exists
-        existing = ing_model.run_query("SELECT id FROM Ingredients WHERE name = %s", (name,))
+            # 1. Check if ingredient already exists
+            existing = ing_model.run_query("SELECT id FROM Ingredients WHERE name = %s", (name,))
 
-        if existing:
-            ing_id = existing[0]['id']
-        else:
-            # 2. If it doesn't exist, create it
+            if existing:
+                ing_id = existing[0]['id']
+            else:
+                # 2. If it doesn't exist, create it
 
-            ing_id = ing_model.run_query("INSERT INTO Ingredients (name, created_by_user_id) VALUES (%s, %s)", (name, current_user.id))
+                ing_id = ing_model.run_query("INSERT INTO Ingredients (name, created_by_user_id) VALUES (%s, %s)", (name, current_user.id))
 
-        # 3. Link the ingredient to the recipe
-        recipe_ingredients_model.run_query(f"""
-                INSERT INTO Recipes_ingredients (recipe_id, ingredient_id, measure, unit_id, prep_notes, order_index, source_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (new_recipe_id, ing_id, ing_measures[i], ing_units[i], ing_prep_notes[i], i, source_id))
+            # 3. Link the ingredient to the recipe
+            recipe_ingredients_model.run_query(f"""
+                    INSERT INTO Recipes_ingredients (recipe_id, ingredient_id, measure, unit_id, prep_notes, order_index, source_id)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, (new_recipe_id, ing_id, ing_measures[i], ing_units[i], ing_prep_notes[i], i, source_id))
     if return_new_recipe_id:
         return new_recipe_id
 
@@ -482,38 +452,80 @@ def local_time_to_utc_range(user_timezone= None, return_now=False)->tuple:
     return utc_start, utc_end
 
 
-def generate_meal(meal_id, return_recipe_list=False)->list[dict]:
+def generate_meal(meal_id, return_recipe_list=False, exclude=(), user_id=None, pantry=None)->list[dict]:
     '''This function generates a meal by taking a meal_id (which corresponds to a meal type like breakfast, lunch, etc.) and randomly selecting a recipe from the
-    database that matches that meal type.
+    database that matches that meal type, avoiding the recipe ids in `exclude` when possible.
+    With a user_id and WEIGHTED_SAMPLING the pick favors ratings, the user's favorites and variety;
+    with pantry (ingredient ids) it favors the recipes those ingredients cover best.
     Returns a single recipe dictionary in a list if return_recipe_list is False, or a list of matching recipes if return_recipe_list is True.'''
-    col = match_meal_to_recipe(meal_id, recipe_model.columns)
-    list_recipes = recipe_model.run_query(f"SELECT * FROM Recipes WHERE {col} = %s", (1,))
+    col = flag_for_meal(meal_id)
     if return_recipe_list:
-        return list_recipes
-    recipe = random.choice(list_recipes)
-    return [recipe]
-
-
-
-def generate_menu(menu_id:int, selected_meals:list)->list[dict]:
+        return recipe_model.run_query(f"SELECT * FROM Recipes WHERE {col} = %s", (1,))
+    # Pick from the in-memory index and fetch only the winning row
+    for _ in range(2):
+        recipe_id = pantry_pick(pantry, col, exclude) if pantry else None
+        if recipe_id is None and user_id and WEIGHTED_SAMPLING:
+            recipe_id = sample_plan([[col]], user_id=user_id, exclude=exclude, weighted=True)[0][0]
+        elif recipe_id is None:
+            recipe_id = catalogue.sample(col, exclude)
+        if recipe_id is None:
+            return []
+        recipe = recipe_model.run_query("SELECT * FROM Recipes WHERE id = %s", (recipe_id,), prepared=True)
+        if recipe:
+            return recipe
+        # Deleted by another process since the index was loaded
+        catalogue.invalidate()
+    return []
+
+
+
+def meal_flags(meal_names:list)->list[str]:
+    '''Map meal type names (e.g. 'Lunch') to their Recipes flag columns (e.g. 'if_lunch').'''
+    meal_ids = {meal['name']: meal['id'] for meal in load_meals_from_db()}
+    return [flag_for_meal(meal_ids[name]) for name in meal_names]
+
+
+def fetch_recipe_names(recipe_ids)->dict:
+    '''Return {recipe_id: {'id', 'name'}} for the given ids, in one query.'''
+    recipe_ids = list({recipe_id for recipe_id in recipe_ids if recipe_id is not None})
+    if not recipe_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    rows = recipe_model.run_query(f"SELECT id, name FROM Recipes WHERE id IN ({placeholders})", tuple(recipe_ids))
+    return {row['id']: row for row in rows or []}
+
+
+def generate_menu(menu_id:int, selected_meals:list, recipe_ids:list=None, recipes:dict=None, user_id:int=None)->list[dict]:
     '''This function generates a menu by taking a menu_id and a list of selected meal types
     (e.g., breakfast, lunch, dinner) and creating a draft menu with randomly selected recipes for each meal type.
+    recipe_ids can hold the recipes already planned for these meal types (see planning.planner),
+    and recipes their prefetched names (see fetch_recipe_names); otherwise both are done here, avoiding
+    user_id's recent recipes (see planning.sampler.recent_recipes) like generate_plan does.
     Returns a list of dictionaries, where each dictionary represents a meal in the menu with its associated recipe and details.'''
     draft_menu_meals = []
-
-    for name in selected_meals:
+    if recipe_ids is None:
+        recent = recent_recipes(user_id) if user_id else None
+        recipe_ids = planner.solve([meal_flags(selected_meals)], user_id=user_id, recent=recent,
+                                   weighted=WEIGHTED_SAMPLING)[0]
+    if recipes is None:
+        recipes = fetch_recipe_names(recipe_ids)
+    meals_by_name = {meal['name']: meal for meal in load_meals_from_db()}
+
+    for name, recipe_id in zip(selected_meals, recipe_ids):
         
-        meal = meal_model.run_query("SELECT id, default_time FROM Meals WHERE name = %s", (name,))[0]
+        meal = meals_by_name[name]
         meal_id = meal['id']
         meal_time_default = meal['default_time']
-        draft_recipe_ids = [meal['recipe_id'] for meal in draft_menu_meals] 
-        recipe = generate_meal(meal_id)[0]
-  
-        # TODO FIX LOOP. AVOID LIMIT
-        attempts = 0
-        while recipe['id'] in draft_recipe_ids and attempts < 5:
-            recipe = generate_meal(meal_id)[0]
-            attempts += 1
+        recipe = recipes.get(recipe_id)
+        if recipe is None:
+            # Deleted since the catalogue was loaded (or no recipes for this meal type)
+            catalogue.invalidate()
+            draft_recipe_ids = {meal['recipe_id'] for meal in draft_menu_meals}
+            recipe = next(iter(generate_meal(meal_id, exclude=draft_recipe_ids)), None)
+            if recipe is None:
+                # No recipe has this meal type: leave the meal out rather than fail the whole menu
+                print(f"No recipes for meal type '{name}', skipping it in menu {menu_id}.")
+                continue
 
         draft_meal = {
                             'menu_id': menu_id,
@@ -541,6 +553,145 @@ def generate_menu(menu_id:int, selected_meals:list)->list[dict]:
     return draft_menu_meals
 
 
+def generate_plan(user_id:int, dates:list, selected_meals:list, shared_ingredients:bool=False)->list[dict]:
+    '''Generate draft menus for several days at once: every recipe is drawn in memory
+    (see planning.planner: time budget, no repeats, category variety) and all Menus and Menu_meals rows are written
+    with two bulk inserts in a single transaction. Unconfirmed drafts already on these dates (such as the
+    ones pregenerate_drafts creates) are replaced; the caller checks for submitted menus.
+    With shared_ingredients the planner favors recipes that share ingredients, for a shorter shopping list.
+    Returns the drafts in the shape menu.html expects: [{menu_id: {date: meals}}].'''
+    plan = planner.solve([meal_flags(selected_meals)] * len(dates), user_id=user_id, weighted=WEIGHTED_SAMPLING,
+                         overlap=shared_ingredients)
+    recipes = fetch_recipe_names(recipe_id for day in plan for recipe_id in day)
+
+    menu_drafts = []
+    with menu_model.transaction():
+        placeholders = ', '.join(['%s'] * len(dates))
+        drafts = menu_model.run_query(f"""
+            SELECT id FROM Menus
+            WHERE user_id = %s AND submitted_at IS NULL AND menu_date IN ({placeholders}) FOR UPDATE
+        """, (user_id, *dates))
+        if drafts:
+            draft_ids = tuple(draft['id'] for draft in drafts)
+            placeholders = ', '.join(['%s'] * len(draft_ids))
+            menu_meals_model.run_query(f"DELETE FROM Menu_meals WHERE menu_id IN ({placeholders})", draft_ids)
+            menu_model.run_query(f"DELETE FROM Menus WHERE id IN ({placeholders})", draft_ids)
+        menu_ids = menu_model.insert_many([{'user_id': user_id, 'menu_date': menu_date} for menu_date in dates])
+        if menu_ids is None:
+            raise RuntimeError("Could not create the menus.")
+        rows = []
+        for menu_id, menu_date, recipe_ids in zip(menu_ids, dates, plan):
+            menu_meals = generate_menu(menu_id, selected_meals, recipe_ids, recipes)
+            rows.extend(menu_meal_rows(menu_meals))
+            menu_drafts.append({menu_id: {menu_date: menu_meals}})
+        if menu_meals_model.insert_many(rows) is None:
+            raise RuntimeError("Could not save the menu meals.")
+    return menu_drafts
+
+
+def menu_meal_rows(menu_meals:list)->list[dict]:
+    '''Menu_meals rows for the meals generate_menu returned.'''
+    return [{
+        'menu_id': meal['menu_id'],
+        'meal_id': meal['meal_id'],
+        'recipe_id': meal['recipe_id'],
+        'meal_time': meal['meal_time'],
+        'regenerated_times': meal['regenerated_times'],
+        'if_picked_manually': meal['if_picked_manually']
+    } for meal in menu_meals]
+
+
+def pregenerate_draft(user_id:int, menu_date, selected_meals:list)->bool:
+    '''Create the user's draft menu for menu_date unless they already have one.
+    Safe to run repeatedly and from several workers or processes: the UNIQUE (user_id, menu_date)
+    key turns the Menus insert into a no-op when the menu exists, so each user/date is created once.
+    Returns True if a draft was created.'''
+    recipe_ids = planner.solve([meal_flags(selected_meals)], user_id=user_id, weighted=WEIGHTED_SAMPLING)[0]
+    if all(recipe_id is None for recipe_id in recipe_ids):
+        # None of the user's meal types has recipes: nothing to pre-generate
+        return False
+    with menu_model.transaction():
+        menu_id = menu_model.run_query("INSERT IGNORE INTO Menus (user_id, menu_date) VALUES (%s, %s)",
+                                       (user_id, menu_date))
+        if not menu_id:
+            return False
+        menu_meals = generate_menu(menu_id, selected_meals, recipe_ids, user_id=user_id)
+        if not menu_meals:
+            # Rolls the empty Menus row back; _pregenerate_job skips this user
+            raise RuntimeError("No recipes left for any of the meal types.")
+        if menu_meals_model.insert_many(menu_meal_rows(menu_meals)) is None:
+            raise RuntimeError("Could not save the menu meals.")
+    return True
+
+
+def _pregenerate_job(job:tuple)->bool:
+    '''Run pregenerate_draft on a worker thread with its own pooled connection.'''
+    user_id, menu_date, selected_meals = job
+    begin_request_scope()
+    try:
+        return pregenerate_draft(user_id, menu_date, selected_meals)
+    except Exception as e:
+        print(f"Error pre-generating the menu of user {user_id} for {menu_date}: {e}")
+        return False
+    finally:
+        end_request_scope()
+
+
+def pregenerate_drafts()->int:
+    '''Create tomorrow's draft menu for every active user whose local time is in PREGENERATE_HOUR,
+    with the meal types of their latest menu, so /menu finds it ready. Run by all_day_tasks.py;
+    any schedule at least hourly reaches every user once, and repeated runs in the hour are no-ops.
+    At most PREGENERATE_WORKERS drafts are generated at once.
+    Returns the number of drafts created.'''
+    now_utc = datetime.now(timezone.utc)
+    due = {}
+    active_users = users_model.iter_query("""
+        SELECT u.id, u.timezone FROM Users u
+        WHERE EXISTS (SELECT 1 FROM Menus m WHERE m.user_id = u.id AND m.menu_date >= CURDATE() - INTERVAL %s DAY)
+    """, (PREGENERATE_ACTIVE_DAYS,))
+    for user in active_users:
+        try:
+            local_now = now_utc.astimezone(ZoneInfo(user['timezone'] or 'UTC'))
+        except Exception:
+            continue
+        if local_now.hour == PREGENERATE_HOUR:
+            due[user['id']] = local_now.date() + timedelta(days=1)
+    if not due:
+        return 0
+
+    placeholders = ', '.join(['%s'] * len(due))
+    existing = menu_model.run_query(f"""
+        SELECT user_id, menu_date FROM Menus
+        WHERE user_id IN ({placeholders}) AND menu_date IN ({', '.join(['%s'] * len(set(due.values())))})
+    """, tuple(due) + tuple(set(due.values())))
+    for menu in existing or []:
+        if due.get(menu['user_id']) == menu['menu_date']:
+            del due[menu['user_id']]
+    if not due:
+        return 0
+
+    # Meal types of each user's latest menu, in the Meals table order
+    placeholders = ', '.join(['%s'] * len(due))
+    latest_meals = menu_meals_model.run_query(f"""
+        SELECT m.user_id, mm.meal_id FROM Menus m
+        JOIN Menu_meals mm ON mm.menu_id = m.id
+        WHERE m.id IN (SELECT MAX(id) FROM Menus WHERE user_id IN ({placeholders}) GROUP BY user_id)
+    """, tuple(due))
+    meal_ids = {}
+    for row in latest_meals or []:
+        meal_ids.setdefault(row['user_id'], set()).add(row['meal_id'])
+    meals = load_meals_from_db()
+    jobs = []
+    for user_id, menu_date in due.items():
+        names = [meal['name'] for meal in meals if meal['id'] in meal_ids.get(user_id, ())]
+        jobs.append((user_id, menu_date, names or [meal['name'] for meal in meals]))
+
+    with ThreadPoolExecutor(max_workers=PREGENERATE_WORKERS) as pool:
+        created = sum(pool.map(_pregenerate_job, jobs))
+    print(f"Pre-generated {created} draft menus for {len(jobs)} users.")
+    return created
+
+
 def fetch_today_menu()->tuple:
     '''This function checks if the user already has a menu for today in the database. If they do, it retrieves that menu and its associated meals.
     If not, it returns an empty list, indicating that a new menu should be generated. It also handles timezone conversion to ensure that "today"
@@ -614,7 +765,10 @@ def fetch_favorites(user_id, return_ids_only=False):
     return results
 
 
-meals_from_db = meal_model.select_all()
+def load_meals_from_db():
+    '''Return the Meals reference rows, loaded on first use rather than at import.
+    Meals is a cached table, so this only hits the database after a change or TTL expiry.'''
+    return meal_model.select_all()
 
 
 @app.route('/')
@@ -653,7 +807,7 @@ def menu():
             WHERE mm.menu_id = %s
             ORDER BY mm.meal_time ASC
         """
-        meals = menu_meals_model.run_query(query_meals, (m_id,))
+        meals = menu_meals_model.run_query(query_meals, (m_id,), prepared=True)
 
         # 4. Format time (HH:MM) for the HTML time input
         for meal in meals:
@@ -673,23 +827,19 @@ def menu():
 @app.route('/init-plan', methods=['POST'])
 @login_required
 def init_plan():
+    meals_from_db = load_meals_from_db()
     # 1. Get the list of names from the checkboxes
     selected_names = request.form.getlist('meals')
     print(f"Selected meal types: {selected_names}")
     user_time_zone = request.form.get('user_timezone', 'UTC')
     start_date = request.form.get('start_date')
     duration_days = request.form.get('duration_days')
-    print(type(duration_days))
     if not selected_names:
         error_message="Please select at least one meal!"
         return render_template('menu.html', error=error_message, all_meals=meals_from_db)
 
     current_date = datetime.now(ZoneInfo(user_time_zone)).date()
     last_valid_date = current_date + timedelta(days=7)
-    n_menus_in_range = menu_model.run_query("""
-                                                SELECT COUNT(*) as count FROM Menus
-                                                WHERE user_id = %s AND menu_date > %s
-                                            """, (current_user.id, current_date))[0]['count']
     if not start_date:
         error_message="Please select a start date!"
         return render_template('menu.html', error=error_message, all_meals=meals_from_db)
@@ -702,61 +852,33 @@ def init_plan():
     elif datetime.strptime(start_date, '%Y-%m-%d').date() > last_valid_date:
         error_message="Start date cannot be more than 7 days in the future!"
         return render_template('menu.html', error=error_message, all_meals=meals_from_db)
-    elif n_menus_in_range >= 7:
+
+    first_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+    dates = [first_date + timedelta(days=day) for day in range(int(duration_days or 1))]
+    # 2. Validate the whole range with one query: future menus and the first date already taken.
+    # Only submitted menus count; unconfirmed drafts (e.g. pre-generated overnight) are replaced by generate_plan
+    existing = menu_model.run_query("""
+        SELECT SUM(menu_date > %s) as count,
+               MIN(CASE WHEN menu_date BETWEEN %s AND %s THEN menu_date END) as first_taken
+        FROM Menus
+        WHERE user_id = %s AND menu_date >= %s AND submitted_at IS NOT NULL
+    """, (current_date, dates[0], dates[-1], current_user.id, current_date))[0]
+    if int(existing['count'] or 0) >= 7:
         error_message="You already have 7 menus scheduled in the future. Please edit or delete existing menus before adding new ones."
         return render_template('menu.html', error=error_message, all_meals=meals_from_db)
+    if existing['first_taken']:
+        error_message = f"A menu for {existing['first_taken']} already exists. Please choose a different date range or edit the existing menu."
+        return render_template('menu.html', error=error_message, all_meals=meals_from_db)
 
-    menu_drafts = []
-
-    for day in range(int(duration_days or 1)):
-        current_date = datetime.strptime(start_date, '%Y-%m-%d').date() + timedelta(days=day)
-        if_draft_already_exists = menu_model.run_query("""
-            SELECT id FROM Menus WHERE user_id = %s AND menu_date = %s
-        """, (current_user.id, current_date))
-        if if_draft_already_exists:
-            error_message = f"A menu for {current_date} already exists. Please choose a different date range or edit the existing menu."
-            return render_template('menu.html', error=error_message, all_meals=meals_from_db)
-
-        menu_current_date = fetch_menu_by_date(current_user.id, current_date)
-        if menu_current_date:
-            menu_id = menu_current_date['id']
-            menu_if_submitted = menu_current_date['submitted_at'] is not None
-            query_meals = """
-                SELECT mm.*, r.name as recipe_name, m.name as meal_type
-                FROM Menu_meals mm
-                JOIN Recipes r ON mm.recipe_id = r.id
-                JOIN Meals m ON mm.meal_id = m.id
-                WHERE mm.menu_id = %s
-            """
-            menu_meals = menu_meals_model.run_query(query_meals, (menu_id,))
-            flash(f"Menu for {current_date} already exists and has been loaded.", "info")
-
-            if menu_id and menu_if_submitted:
-                error_message = f"A menu for {current_date} already exists and has been submitted. You cannot create a new one."
-                return render_template('menu.html', error=error_message, all_meals=meals_from_db)
-
-        else:
-            # 2. Create a new menu and get its ID
-            menu_id = menu_model.insert({'user_id': current_user.id, 'menu_date': current_date})
-            menu_meals = generate_menu(menu_id, selected_names)
-            for meal in menu_meals:
-                try:
-                    meal['regenerated_times'] = 0
-                    meal['if_picked_manually'] = 0
-                    menu_meals_model.insert({
-                        'menu_id': meal['menu_id'],
-                        'meal_id': meal['meal_id'],
-                        'recipe_id': meal['recipe_id'],
-                        'meal_time': meal['meal_time'],
-                        'regenerated_times': meal['regenerated_times'],
-                        'if_picked_manually': meal['if_picked_manually']
-                    })
-                except Exception as e:
-                    print(f"Error inserting meal into database: {e}")
-                    error_message = f"An error occurred while saving your {meal['meal_type']} for {current_date}. Please try again."
-                    return render_template('menu.html', error=error_message, all_meals=meals_from_db)
-        menu_drafts.append({menu_id: {current_date: menu_meals}})
-        success_message = "Your meal plan has been initialized! You can view and edit each day's meals by clicking the 'Regenerate' button for that day."
+    # 3. Generate every day in memory and save them together
+    try:
+        menu_drafts = generate_plan(current_user.id, dates, selected_names,
+                                    shared_ingredients=request.form.get('shared_ingredients') == '1')
+    except Exception as e:
+        print(f"Error saving meal plan: {e}")
+        error_message = "An error occurred while saving your meal plan. Please try again."
+        return render_template('menu.html', error=error_message, all_meals=meals_from_db)
+    success_message = "Your meal plan has been initialized! You can view and edit each day's meals by clicking the 'Regenerate' button for that day."
 
     return render_template('menu.html',
                            menus=menu_drafts,
@@ -772,7 +894,7 @@ def regenerate_meal(meal_id):
         return redirect(url_for('menu'))
 
     # 1. Fetch current meal to get its existing time
-    query = "SELECT meal_time, meal_id FROM Menu_meals WHERE menu_id = %s AND meal_id = %s"
+    query = "SELECT meal_time, meal_id, recipe_id FROM Menu_meals WHERE menu_id = %s AND meal_id = %s"
     current_meal_data = menu_meals_model.run_query(query, (menu_id, meal_id))
 
     if not current_meal_data:
@@ -782,7 +904,8 @@ def regenerate_meal(meal_id):
     existing_time = current_meal_data[0]['meal_time']
 
     # 2. Generate the new recipe
-    new_recipe = generate_meal(meal_id)
+    new_recipe = generate_meal(meal_id, exclude={current_meal_data[0]['recipe_id']}, user_id=current_user.id,
+                               pantry=session.get('pantry'))
 
     if new_recipe and len(new_recipe) > 0:
         try:
@@ -813,27 +936,39 @@ def regenerate_meal(meal_id):
 @login_required
 def regenerate_full_menu(menu_id):
     # 1. Fetch all meal slots currently in this draft
-    query = "SELECT meal_id FROM Menu_meals WHERE menu_id = %s"
-    current_meals = menu_meals_model.run_query(query, (menu_id,))
+    query = "SELECT meal_id, recipe_id FROM Menu_meals WHERE menu_id = %s"
+    current_meals = menu_meals_model.run_query(query, (menu_id,), prepared=True)
 
     if not current_meals:
         flash("Menu not found.", "error")
         return redirect(url_for('menu'))
 
-    # 2. Loop through every meal and update it with a new random recipe
-    for meal in current_meals:
-        db_meal_id = meal['meal_id']
-        new_recipe = generate_meal(db_meal_id)
-
-        if new_recipe:
-            update_query = """
-                UPDATE Menu_meals
-                SET recipe_id = %s,
-                    regenerated_times = regenerated_times + 1,
-                    if_picked_manually = 0
-                WHERE menu_id = %s AND meal_id = %s
-            """
-            menu_meals_model.run_query(update_query, (new_recipe[0]['id'], menu_id, db_meal_id))
+    # 2. Draw new recipes for every slot at once, steering clear of the current ones
+    flags = [flag_for_meal(meal['meal_id']) for meal in current_meals]
+    new_recipe_ids = sample_plan([flags], user_id=current_user.id, exclude={meal['recipe_id'] for meal in current_meals},
+                                 weighted=WEIGHTED_SAMPLING)[0]
+    picked = [(meal['meal_id'], recipe_id) for meal, recipe_id in zip(current_meals, new_recipe_ids)
+              if recipe_id is not None]
+
+    # 3. Apply them with a single UPDATE joined to the picks
+    if picked:
+        derived = ' UNION ALL '.join(["SELECT %s AS meal_id, %s AS recipe_id"] * len(picked))
+        update_query = f"""
+            UPDATE Menu_meals mm
+            JOIN ({derived}) picked ON mm.meal_id = picked.meal_id
+            SET mm.recipe_id = picked.recipe_id,
+                mm.regenerated_times = mm.regenerated_times + 1,
+                mm.if_picked_manually = 0
+            WHERE mm.menu_id = %s
+        """
+        params = tuple(value for pair in picked for value in pair) + (menu_id,)
+        try:
+            with menu_meals_model.transaction():
+                menu_meals_model.run_query(update_query, params)
+        except Exception as e:
+            print(f"Database Error: {e}")
+            flash("Failed to update database.", "error")
+            return redirect(url_for('menu'))
 
     flash(f"Entire menu for draft #{menu_id} has been regenerated!", "success")
     return redirect(url_for('menu'))
@@ -884,10 +1019,15 @@ def submit_final_menu():
 @app.route('/delete-menu/<int:menu_id>', methods=['GET', 'POST'])
 @login_required
 def delete_menu(menu_id):
-    menu_meals_model.run_query("DELETE FROM Menu_meals WHERE menu_id = %s", (menu_id,))
-    shopping_list_items_model.run_query("DELETE FROM Shopping_list_ingredients WHERE shop_list_id IN (SELECT id FROM Shopping_list WHERE menu_id IN (SELECT id FROM Menus WHERE user_id = %s AND submitted_at IS NULL))", (current_user.id,))
-    shopping_list_model.run_query("DELETE FROM Shopping_list WHERE menu_id IN (SELECT id FROM Menus WHERE user_id = %s AND submitted_at IS NULL)", (current_user.id,))
-    menu_model.run_query("DELETE FROM Menus WHERE id = %s", (menu_id,))
+    try:
+        with menu_model.transaction():
+            menu_meals_model.run_query("DELETE FROM Menu_meals WHERE menu_id = %s", (menu_id,))
+            shopping_list_items_model.run_query("DELETE FROM Shopping_list_ingredients WHERE shop_list_id IN (SELECT id FROM Shopping_list WHERE menu_id IN (SELECT id FROM Menus WHERE user_id = %s AND submitted_at IS NULL))", (current_user.id,))
+            shopping_list_model.run_query("DELETE FROM Shopping_list WHERE menu_id IN (SELECT id FROM Menus WHERE user_id = %s AND submitted_at IS NULL)", (current_user.id,))
+            menu_model.run_query("DELETE FROM Menus WHERE id = %s", (menu_id,))
+    except Exception as e:
+        print(f"Error deleting menu {menu_id}: {e}")
+        flash("An error occurred while deleting the menu. Please try again.", "error")
     return redirect(url_for('menu'))
 
 @app.route('/delete-all_drafts', methods=['GET', 'POST'])
@@ -895,10 +1035,16 @@ def delete_menu(menu_id):
 def delete_all_drafts():
     current_user_id = current_user.id
 
-    menu_meals_model.run_query("DELETE FROM Menu_meals WHERE menu_id IN (SELECT id FROM Menus WHERE user_id = %s AND submitted_at IS NULL)", (current_user_id,))
-    shopping_list_items_model.run_query("DELETE FROM Shopping_list_ingredients WHERE shop_list_id IN (SELECT id FROM Shopping_list WHERE menu_id IN (SELECT id FROM Menus WHERE user_id = %s AND submitted_at IS NULL))", (current_user_id,))
-    shopping_list_model.run_query("DELETE FROM Shopping_list WHERE menu_id IN (SELECT id FROM Menus WHERE user_id = %s AND submitted_at IS NULL)", (current_user_id,))
-    menu_model.run_query("DELETE FROM Menus WHERE user_id = %s AND submitted_at IS NULL", (current_user_id,))
+    try:
+        with menu_model.transaction():
+            menu_meals_model.run_query("DELETE FROM Menu_meals WHERE menu_id IN (SELECT id FROM Menus WHERE user_id = %s AND submitted_at IS NULL)", (current_user_id,))
+            shopping_list_items_model.run_query("DELETE FROM Shopping_list_ingredients WHERE shop_list_id IN (SELECT id FROM Shopping_list WHERE menu_id IN (SELECT id FROM Menus WHERE user_id = %s AND submitted_at IS NULL))", (current_user_id,))
+            shopping_list_model.run_query("DELETE FROM Shopping_list WHERE menu_id IN (SELECT id FROM Menus WHERE user_id = %s AND submitted_at IS NULL)", (current_user_id,))
+            menu_model.run_query("DELETE FROM Menus WHERE user_id = %s AND submitted_at IS NULL", (current_user_id,))
+    except Exception as e:
+        print(f"Error deleting drafts: {e}")
+        flash("An error occurred while deleting your drafts. Please try again.", "error")
+        return redirect(url_for('menu'))
 
     flash("All draft menus have been deleted.", "success")
     return redirect(url_for('menu'))
@@ -922,16 +1068,32 @@ def manual_search(meal_id=None, menu_id=None):
 
     search_query = request.args.get('search', '')
     category_id = request.args.get('category')
+    pantry_query = request.args.get('pantry', '')
     params = []
     query = "SELECT * FROM Recipes WHERE"
 
-    valid_meal_ids = {m['id'] for m in meals_from_db}
+    valid_meal_ids = {m['id'] for m in load_meals_from_db()}
+    col = None
     if meal_id in valid_meal_ids:
-        col = match_meal_to_recipe(meal_id, recipe_model.columns)
+        col = flag_for_meal(meal_id)
         query += f" {col} = 1"
     else:
         query += " 1=1"
 
+    # "Cook from my pantry": rank by how much of each recipe the listed ingredients cover.
+    # The pantry is kept in the session so regenerating a meal favors it too.
+    pantry_ranking = {}
+    if pantry_query:
+        pantry_ids = ingredient_ids_by_name(pantry_query.split(','))
+        session['pantry'] = pantry_ids
+        ranked = rank_by_pantry(pantry_ids, col, limit=PANTRY_RESULTS)
+        pantry_ranking = {r['recipe_id']: (position, r) for position, r in enumerate(ranked)}
+        placeholders = ', '.join(['%s'] * len(pantry_ranking)) or 'NULL'
+        query += f" AND id IN ({placeholders})"
+        params.extend(pantry_ranking)
+    else:
+        session.pop('pantry', None)
+
     if search_query:
         query += " AND name LIKE %s"
         params.append(f"%{search_query}%")
@@ -947,6 +1109,10 @@ def manual_search(meal_id=None, menu_id=None):
 
     print(f"DEBUG QUERY: {query} with PARAMS: {params}")
     recipes = recipe_model.run_query(query, tuple(params))
+    if pantry_ranking and recipes:
+        recipes.sort(key=lambda r: pantry_ranking[r['id']][0])
+        for recipe in recipes:
+            recipe['pantry_coverage'] = round(pantry_ranking[recipe['id']][1]['coverage'] * 100)
     categories = recipe_categories_model.select_all()
 
     return render_template('manual_search.html',
@@ -954,6 +1120,7 @@ def manual_search(meal_id=None, menu_id=None):
                            categories=categories,
                            meal_id=meal_id,
                            search_query=search_query,
+                           pantry_query=pantry_query,
                            favorite_ids=favorite_ids,
                            menu_id=menu_id,
                            user_id=current_user.id if current_user.is_authenticated else None)
@@ -966,7 +1133,7 @@ def select_recipe(meal_index, recipe_id, menu_id):
     if draft_menu:
         draft_menu = draft_menu[0]  # Get the single meal entry for this meal_index
         # Fetch the full recipe details
-        recipe = recipe_model.run_query("SELECT * FROM Recipes WHERE id = %s", (recipe_id,))[0]
+        recipe = recipe_model.run_query("SELECT * FROM Recipes WHERE id = %s", (recipe_id,), prepared=True)[0]
 
         # Update the specific meal in the draft
         draft_menu['recipe_id'] = recipe['id']
@@ -988,7 +1155,7 @@ def select_recipe(meal_index, recipe_id, menu_id):
 @login_required
 def recipe_details(recipe_id, menu_id=None):
     favorite_ids = fetch_favorites(current_user.id, return_ids_only=True)
-    recipe = recipe_model.run_query("SELECT * FROM Recipes WHERE id = %s", (recipe_id,))[0]
+    recipe = recipe_model.run_query("SELECT * FROM Recipes WHERE id = %s", (recipe_id,), prepared=True)[0]
 
     query = """
         SELECT i.name as ingredient_name, ri.measure, u.name as unit_name, ri.prep_notes
@@ -1060,7 +1227,7 @@ def api_add_ingredient():
 
 @app.route('/add-recipe', methods=['GET', 'POST'])
 @login_required
-def add_recipe(meals_from_db=meals_from_db):
+def add_recipe():
     # 1. Get the context from session so we know which menu slot we are filling
     manual_search_data = session.get('manual_search')
 
@@ -1075,7 +1242,7 @@ def add_recipe(meals_from_db=meals_from_db):
                 menu_id = manual_search_data.get('menu_id')
 
                 # Get the actual meal_type_id (e.g., ID for 'Breakfast')
-                meal_type_id = meals_from_db[meal_index]['id']
+                meal_type_id = load_meals_from_db()[meal_index]['id']
 
                 # 2. UPDATE THE MENU DIRECTLY
                 # We update the specific menu and meal slot with the new recipe_id
@@ -1098,13 +1265,13 @@ def add_recipe(meals_from_db=meals_from_db):
             return redirect(url_for('add_recipe'))
 
     all_ingredients = recipe_model.run_query("SELECT name FROM Ingredients ORDER BY name ASC")
-    ing_categories = recipe_model.run_query("SELECT * FROM Ingredient_categories WHERE name != 'Household & Cleaning'")
-    categories = recipe_model.run_query("SELECT * FROM Recipe_categories")
-    countries = recipe_model.run_query("SELECT * FROM Countries")
-    units = recipe_model.run_query("SELECT id, name FROM Units")
+    ing_categories = ing_categories_model.run_query("SELECT * FROM Ingredient_categories WHERE name != 'Household & Cleaning'")
+    categories = recipe_categories_model.run_query("SELECT * FROM Recipe_categories")
+    countries = country_model.run_query("SELECT * FROM Countries")
+    units = units_model.run_query("SELECT id, name FROM Units")
     user_source_id = source_model.run_query("SELECT id FROM Data_sources WHERE name = %s", ('User_submitted',))[0]['id']
     meals_db = meal_model.select_all()
-    none_country_id = recipe_model.run_query("SELECT id FROM Countries WHERE name = 'None'")[0]['id']
+    none_country_id = country_model.run_query("SELECT id FROM Countries WHERE name = 'None'")[0]['id']
 
     return render_template('add_recipe.html',
                            categories=categories,
@@ -1125,7 +1292,7 @@ def update_menu_item():
     menu_id = request.form.get('menu_id')
     meal_index = int(request.form.get('meal_id'))
 
-    meal_type_id = meals_from_db[meal_index]['id']
+    meal_type_id = load_meals_from_db()[meal_index]['id']
 
     query = "UPDATE Menu_meals SET recipe_id = %s, if_picked_manually = 1 WHERE menu_id = %s AND meal_id = %s"
     menu_meals_model.run_query(query, (recipe_id, menu_id, meal_type_id))
@@ -1139,22 +1306,8 @@ def update_menu_item():
 def edit_recipe(recipe_id):
     recipe = recipe_model.select_by_id(recipe_id)
     meals_db = meal_model.select_all()
-    active_columns = [col.lower() for col, value in recipe.items() if value == 1]
-
     for meal_ in meals_db:
-        # 1. Get the name and strip the 's' if it exists for a looser match
-        name = meal_.get('name', '').lower().strip()
-        is_match = False
-        for col in active_columns:
-            norm_col = col.replace('if_', '').replace('_', ' ');
-            print(f"Comparing meal name '{name}' with column '{norm_col}'")
-            # 2. Check if the meal name is in the column OR the column name is in the meal name
-            if name in norm_col or norm_col in name:
-                is_match = True
-                break
-        meal_['checked'] = is_match
-    for meal in meals_db:
-        print(f"Meal: {meal['name']}, Checked: {meal['checked']}")
+        meal_['checked'] = recipe.get(flag_for_meal(meal_['id'])) == 1
 
     ingredients = recipe_ingredients_model.run_query("""
         SELECT ri.*, i.name as name
@@ -1185,10 +1338,10 @@ def edit_recipe(recipe_id):
     recipe['cook_mins'] = cook_split[1]
 
     all_ingredients = recipe_model.run_query("SELECT name FROM Ingredients ORDER BY name ASC")
-    ing_categories = recipe_model.run_query("SELECT * FROM Ingredient_categories WHERE name != 'Household & Cleaning'")
-    categories = recipe_model.run_query("SELECT * FROM Recipe_categories")
-    countries = recipe_model.run_query("SELECT * FROM Countries")
-    units = recipe_model.run_query("SELECT id, name FROM Units")
+    ing_categories = ing_categories_model.run_query("SELECT * FROM Ingredient_categories WHERE name != 'Household & Cleaning'")
+    categories = recipe_categories_model.run_query("SELECT * FROM Recipe_categories")
+    countries = country_model.run_query("SELECT * FROM Countries")
+    units = units_model.run_query("SELECT id, name FROM Units")
     user_source_id = source_model.run_query("SELECT id FROM Data_sources WHERE name = %s", ('User_submitted',))[0]['id']
 
     response = make_response(render_template('edit_recipe.html',
@@ -1227,11 +1380,13 @@ def delete_recipe(recipe_id):
         print(F'DEBUG form: {request.form.get("from_favorites")}, from_favorites: {from_favorites}')
         # First, remove from favorites if it exists there to avoid orphaned records
         # TODO - This should ideally be handled with ON DELETE CASCADE in the database to avoid this manual step and ensure data integrity
-        if_favorite = favorites_recipes_model.run_query("SELECT id FROM User_favorite_recipes WHERE recipe_id = %s AND user_id = %s", (recipe_id, current_user.id))
-        if if_favorite:
-            favorites_recipes_model.run_query("DELETE FROM User_favorite_recipes WHERE recipe_id = %s AND user_id = %s", (recipe_id, current_user.id))
-        recipe_ingredients_model.run_query("DELETE FROM Recipes_ingredients WHERE recipe_id = %s", (recipe_id,))
-        recipe_model.run_query("DELETE FROM Recipes WHERE id = %s AND created_by_user_id = %s", (recipe_id, current_user.id))
+        with recipe_model.transaction():
+            if_favorite = favorites_recipes_model.run_query("SELECT id FROM User_favorite_recipes WHERE recipe_id = %s AND user_id = %s", (recipe_id, current_user.id))
+            if if_favorite:
+                favorites_recipes_model.run_query("DELETE FROM User_favorite_recipes WHERE recipe_id = %s AND user_id = %s", (recipe_id, current_user.id))
+                forget_favorite_tables(current_user.id)
+            recipe_ingredients_model.run_query("DELETE FROM Recipes_ingredients WHERE recipe_id = %s", (recipe_id,))
+            recipe_model.run_query("DELETE FROM Recipes WHERE id = %s AND created_by_user_id = %s", (recipe_id, current_user.id))
         flash('Recipe deleted successfully!', 'success')
         if from_favorites:
             return redirect(url_for('favorites'))
@@ -1264,6 +1419,7 @@ def add_favorite(recipe_id):
         VALUES (%s, %s)
     """
     favorites_recipes_model.run_query(query, (current_user.id, recipe_id))
+    forget_favorite_tables(current_user.id)
 
     return redirect(request.referrer or url_for('manual_search', meal_index=-1))
 
@@ -1279,6 +1435,7 @@ def remove_favorite(recipe_id):
         WHERE user_id = %s AND recipe_id = %s
     """
     favorites_recipes_model.run_query(query, (current_user.id, recipe_id))
+    forget_favorite_tables(current_user.id)
 
     return redirect(request.referrer or url_for('manual_search', meal_index=-1))
 
@@ -1365,34 +1522,14 @@ def shopping_list(menu_id=None, shop_list_id=None):
                 menu_date = menu_date_row[0]['menu_date']
                 shopping_list_name = f"Shopping List for menu: {menu_date.strftime('%B %d, %Y')}"
 
-                # Create the main list record
-                shopping_list_id = shopping_list_model.run_query(
-                    "INSERT INTO Shopping_list (name, user_id, menu_id, is_menu) VALUES (%s, %s, %s, %s)",
-                    (shopping_list_name, current_user.id, menu_id, 1)
-                )
-                select_items_query = """
-                    SELECT
-                        %s as shop_list_id,
-                        ri.ingredient_id,
-                        SUM(ri.measure) as measure,
-                        u.name as units,
-                        icm.category_id
-                    FROM Recipes_ingredients ri
-                    JOIN Menu_meals mm ON ri.recipe_id = mm.recipe_id
-                    JOIN Units u ON ri.unit_id = u.id
-                    LEFT JOIN Ingredients_categories_map icm ON ri.ingredient_id = icm.ingredient_id
-                    WHERE mm.menu_id = %s
-                    GROUP BY ri.ingredient_id, u.name, icm.category_id"""
-
-                select_items = recipe_model.run_query(select_items_query, (shopping_list_id, menu_id))
-                final_shop_list = consolidate_by_ingredient(select_items)
-                # RUN SNAPSHOT ONLY HERE (inside the 'else')
-                snapshot_sql = """
-                    INSERT INTO Shopping_list_ingredients (shop_list_id, ingredient_id, measure, units, category_id)
-                VALUES (%s, %s, %s, %s, %s)
-                """
-                for item in final_shop_list:
-                    shopping_list_items_model.run_query(snapshot_sql, (shopping_list_id, item['ingredient_id'], item['measure'], item['units'], item['category_id']))
+                # Create the main list record and snapshot its consolidated ingredients together
+                with shopping_list_model.transaction():
+                    shopping_list_id = shopping_list_model.run_query(
+                        "INSERT INTO Shopping_list (name, user_id, menu_id, is_menu) VALUES (%s, %s, %s, %s)",
+                        (shopping_list_name, current_user.id, menu_id, 1)
+                    )
+                    # RUN SNAPSHOT ONLY HERE (inside the 'else')
+                    snapshot_menus(shopping_list_id, [menu_id])
 
         else:
             # Handle creating a completely empty list
@@ -1417,46 +1554,54 @@ def shopping_list(menu_id=None, shop_list_id=None):
         cat_ids = request.form.getlist('item_category_ids[]')
         shop_list_name = request.form.get('shop_list_name', '').strip()
 
-        if shop_list_name:
-            shopping_list_model.run_query("UPDATE Shopping_list SET name = %s WHERE id = %s", (shop_list_name, shopping_list_id))
-
-        shopping_list_items_model.run_query("DELETE FROM Shopping_list_ingredients WHERE shop_list_id = %s", (shopping_list_id,))
-
-        for i in range(len(names)):
-            name = names[i].strip().lower()
-            unit = units[i].strip().lower()
-            price = float(prices[i]) if prices[i] != '' else 0.0
-            checked = int(checked_values[i]) if checked_values[i] != '' else 0
-
-            if not name: continue
+        # Rename and write only the changed items in one transaction, so a failed item never leaves the list half-saved
+        try:
+            with shopping_list_model.transaction():
+                if shop_list_name:
+                    shopping_list_model.run_query("UPDATE Shopping_list SET name = %s WHERE id = %s", (shop_list_name, shopping_list_id))
+
+                # Resolve every item name to an ingredient in one query
+                known = ingredient_ids_for(names)
+                items = []
+                for i in range(len(names)):
+                    name = names[i].strip().lower()
+                    unit = units[i].strip().lower()
+                    price = float(prices[i]) if prices[i] != '' else 0.0
+                    checked = int(checked_values[i]) if checked_values[i] != '' else 0
+
+                    if not name: continue
+
+                    if name in known:
+                        # Existing Ingredient: ingredient_id set, item_name left NULL
+                        ingredient_id, item_name = known[name], None
+                    else:
+                        # Custom Item: ingredient_id must be NULL to satisfy chk_ingredient_or_custom
+                        ingredient_id, item_name = None, name
+                        if not cat_ids[i] or cat_ids[i] == 'null':
+                            cat_ids[i] = 0
+                    items.append({
+                        'ingredient_id': ingredient_id,
+                        'item_name': item_name,
+                        'measure': measures[i],
+                        'units': unit,
+                        'price': price,
+                        'if_checked': checked,
+                        'category_id': cat_ids[i],
+                    })
 
-            # Check if ingredient exists in DB
-            ing = recipe_model.run_query("SELECT id FROM Ingredients WHERE LOWER(name) = LOWER(%s)", (name,))
-
-            if ing:
-                # Existing Ingredient: ingredient_id set, item_name left NULL (default)
-                shopping_list_items_model.run_query(
-                    """INSERT INTO Shopping_list_ingredients
-                       (shop_list_id, ingredient_id, measure, units, price, if_checked, category_id)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s)""",
-                    (shopping_list_id, ing[0]['id'], measures[i], unit, price, checked, cat_ids[i])
-                )
-            else:
-                # Custom Item: ingredient_id must be NULL to satisfy chk_ingredient_or_custom
-                if not cat_ids[i] or cat_ids[i] == 'null':
-                    cat_ids[i] = 0
-                shopping_list_items_model.run_query(
-                    """INSERT INTO Shopping_list_ingredients
-                       (shop_list_id, ingredient_id, item_name, measure, units, price, if_checked, category_id)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
-                    (shopping_list_id, None, name, measures[i], unit, price, checked, cat_ids[i])
-                )
+                save_items(shopping_list_id, items, request.form.get('list_version'))
+        except VersionConflict:
+            flash("Someone else changed this list while you were editing it. Here is the latest version; please make your changes again.", "error")
+        except Exception as e:
+            print(f"Error saving shopping list {shopping_list_id}: {e}")
+            flash("An error occurred while saving your shopping list. Please try again.", "error")
         return redirect(url_for('shopping_list', shop_list_id=shopping_list_id, shop_list_name=shop_list_name))
 
     # --- GET Logic ---
     # 1. Fetch Items for the List
     db_query = """
         SELECT
+            sli.id,
             COALESCE(i.name, sli.item_name) as name,
             sli.measure, sli.units, sli.price, sli.if_checked,
             ic.name as category,
@@ -1468,13 +1613,14 @@ def shopping_list(menu_id=None, shop_list_id=None):
         ORDER BY category, name
     """
     items = shopping_list_items_model.run_query(db_query, (shopping_list_id,))
-    shop_list_name = shopping_list_model.run_query("SELECT name FROM Shopping_list WHERE id = %s", (shopping_list_id,))[0]['name'] or "My Shopping List"
+    list_row = shopping_list_model.run_query("SELECT name, version FROM Shopping_list WHERE id = %s", (shopping_list_id,))[0]
+    shop_list_name = list_row['name'] or "My Shopping List"
 
     # 2. Fetch Data for Selects and Datalists
     # Full list of categories (ID and Name)
-    all_cats = recipe_model.run_query("SELECT id, name FROM Ingredient_categories ORDER BY name")
+    all_cats = ing_categories_model.run_query("SELECT id, name FROM Ingredient_categories ORDER BY name")
 
-    all_units = recipe_model.run_query("SELECT name FROM Units ORDER BY name")
+    all_units = units_model.run_query("SELECT name FROM Units ORDER BY name")
 
     # Full list of ingredients for the datalist search
     all_ingredients = recipe_model.run_query("SELECT name FROM Ingredients ORDER BY name ASC")
@@ -1496,6 +1642,7 @@ def shopping_list(menu_id=None, shop_list_id=None):
                            ing_map=ing_category_map,
                            shop_list_id=shopping_list_id,
                            shop_list_name=shop_list_name,
+                           list_version=list_row['version'],
                            is_shared=is_shared)
 
 @app.route('/merge_menus_to_shopping_list', methods=['POST', 'GET'])
@@ -1521,31 +1668,13 @@ def merge_menus_to_shopping_list():
             date = menu_model.run_query("SELECT menu_date FROM Menus WHERE id = %s", (id,))
             date_range.append(date[0]['menu_date'] if date else user_now)
         shopping_list_name = f"Merged Shopping List - {date_range[0].strftime('%B %d')} to {date_range[-1].strftime('%B %d')}"
-    shopping_list_id =shopping_list_model.insert({
-        'user_id': user_id,
-        'name': shopping_list_name,
-        'menu_id': selected_ids[0] if len(selected_ids) == 1 else None
-    })
-    selected_ids_tuple = tuple(selected_ids)
-    placeholders = ','.join(['%s'] * len(selected_ids_tuple))
-    snapshot_sql = F"""
-                    INSERT INTO Shopping_list_ingredients (shop_list_id, ingredient_id, measure, units, category_id)
-                    SELECT
-                        %s as shop_list_id,
-                        ri.ingredient_id,
-                        SUM(ri.measure) as measure,
-                        u.name as units,
-                        icm.category_id
-                    FROM Recipes_ingredients ri
-                    JOIN Menu_meals mm ON ri.recipe_id = mm.recipe_id
-                    JOIN Units u ON ri.unit_id = u.id
-                    LEFT JOIN Ingredients_categories_map icm ON ri.ingredient_id = icm.ingredient_id
-                    WHERE mm.menu_id IN ({placeholders})
-                    GROUP BY ri.ingredient_id, u.name, icm.category_id
-                """
-    params = tuple([shopping_list_id] + list(selected_ids_tuple))
-
-    shopping_list_items_model.run_query(snapshot_sql, params)
+    with shopping_list_model.transaction():
+        shopping_list_id = shopping_list_model.insert({
+            'user_id': user_id,
+            'name': shopping_list_name,
+            'menu_id': selected_ids[0] if len(selected_ids) == 1 else None
+        })
+        snapshot_menus(shopping_list_id, selected_ids)
 
     flash(f"Successfully merged {len(selected_ids)} menus into your shopping list!", "success")
 
@@ -1651,6 +1780,51 @@ def save_shared_list(shopping_list_id):
     return redirect(url_for('shopping_list', shop_list_id=shopping_list_id))
 
 
+def shopping_list_access(shop_list_id, user_id):
+    """True if the user owns or shares the list, False if not, None if there is no such list."""
+    rows = shopping_list_model.run_query(
+        """SELECT sl.user_id = %s OR EXISTS (
+               SELECT 1 FROM Shopping_list_shares sls WHERE sls.shopping_list_id = sl.id AND sls.user_id = %s
+           ) AS allowed
+           FROM Shopping_list sl WHERE sl.id = %s""",
+        (user_id, user_id, shop_list_id)
+    )
+    if not rows:
+        return None
+    return bool(rows[0]['allowed'])
+
+
+@app.route('/api/shopping-lists/<int:shop_list_id>/items', methods=['PATCH'])
+@login_required
+def api_change_shopping_list_item(shop_list_id):
+    """
+    Change one item of a (shared) list without re-posting the whole form.
+    Body: {"version": n, "action": "toggle"|"update"|"add"|"remove", "item_id": id, "fields": {...}}.
+    Returns the new version and only the changed rows; 409 with the current
+    version if someone else changed the list first.
+    """
+    access = shopping_list_access(shop_list_id, current_user.id)
+    if access is None:
+        return jsonify({'error': 'Not found'}), 404
+    if not access:
+        return jsonify({'error': 'Forbidden'}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        result = change_item(shop_list_id, data.get('version'), data.get('action'),
+                             item_id=data.get('item_id'), fields=data.get('fields'))
+    except VersionConflict as e:
+        return jsonify({'error': 'Conflict', 'version': e.version}), 409
+    except LookupError:
+        return jsonify({'error': 'Not found'}), 404
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error changing shopping list {shop_list_id}: {e}")
+        return jsonify({'error': 'Could not save the change'}), 500
+    return jsonify(result)
+
+
 @app.route('/shopping-lists/<int:shop_list_id>/pdf')
 @login_required
 def save_pdf(shop_list_id):
@@ -2111,4 +2285,7 @@ def gone(e):
     return render_template('410.html'), 410
 
 if __name__ == '__main__':
+    # Open the pooled connections up front so the first requests don't pay for the handshakes;
+    # scripts importing app open connections only as their queries need them
+    init_pool(prewarm=True)
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+Benchmark of shopping-list consolidation on synthetic rows (no database needed).
+
+Compares the original consolidate_by_ingredient (dict loop, Units re-read on
+every call; the re-read is simulated by rebuilding the unit table from rows)
+with the vectorized shopping.consolidate.consolidate_rows, and checks that
+both return the same list.
+
+Usage (from the project root):
+    python benchmarks/bench_consolidate.py --rows 10000 --repeat 20
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shopping.consolidate import consolidate_rows
+
+UNIT_ROWS = [
+    {'name': 'g', 'category': 'Mass', 'factor': 1}, {'name': 'kg', 'category': 'Mass', 'factor': 1000},
+    {'name': 'oz', 'category': 'Mass', 'factor': 28.35}, {'name': 'lb', 'category': 'Mass', 'factor': 453.6},
+    {'name': 'ml', 'category': 'Volume', 'factor': 1}, {'name': 'l', 'category': 'Volume', 'factor': 1000},
+    {'name': 'tbsp', 'category': 'Volume', 'factor': 15}, {'name': 'tsp', 'category': 'Volume', 'factor': 5},
+    {'name': 'cup', 'category': 'Volume', 'factor': 240}, {'name': 'pcs', 'category': 'Count', 'factor': 1},
+    {'name': 'clove', 'category': 'Count', 'factor': 1}, {'name': 'slice', 'category': 'Count', 'factor': 1},
+    {'name': 'to serve', 'category': 'Subjective', 'factor': 1}, {'name': 'pinch', 'category': 'Subjective', 'factor': 1},
+]
+
+
+def original_consolidate(rows, ingredient_densities=None):
+    """consolidate_by_ingredient as it was, with the Units query replaced by UNIT_ROWS."""
+    unit_rows = [dict(row) for row in UNIT_ROWS]
+    unit_metadata = {row['name'].lower().strip(): {'category': row['category'], 'factor': float(row['factor'])} for row in unit_rows}
+    consolidated = {}
+    ingredient_densities = ingredient_densities or {}
+    for row in rows:
+        ing_id = row['ingredient_id']
+        measure = float(row['measure'])
+        unit_name = row['units'].lower().strip()
+        if ing_id not in consolidated:
+            consolidated[ing_id] = {'total_base_mass': 0.0, 'total_base_volume': 0.0, 'counts': {},
+                                    'category_id': row['category_id']}
+        u_info = unit_metadata.get(unit_name)
+        if not u_info:
+            consolidated[ing_id]['counts'][unit_name] = consolidated[ing_id]['counts'].get(unit_name, 0) + measure
+            continue
+        factor = float(u_info['factor'])
+        category = u_info['category']
+        if category == 'Mass':
+            consolidated[ing_id]['total_base_mass'] += measure * factor
+        elif category == 'Volume':
+            consolidated[ing_id]['total_base_volume'] += measure * factor
+        elif category == 'Count':
+            consolidated[ing_id]['counts'][unit_name] = consolidated[ing_id]['counts'].get(unit_name, 0) + measure
+        else:
+            consolidated[ing_id]['counts'][unit_name] = "As required"
+    final_shopping_list = []
+    for ing_id, data in consolidated.items():
+        density = float(ingredient_densities.get(ing_id, 1.0))
+        total_grams = data['total_base_mass'] + (data['total_base_volume'] * density)
+        if total_grams > 0:
+            if total_grams >= 1000:
+                final_shopping_list.append({'ingredient_id': ing_id, 'measure': round(total_grams / 1000, 2),
+                                            'units': 'kg', 'category_id': data['category_id']})
+            else:
+                final_shopping_list.append({'ingredient_id': ing_id, 'measure': round(total_grams, 1),
+                                            'units': 'g', 'category_id': data['category_id']})
+        for unit, qty in data['counts'].items():
+            final_shopping_list.append({'ingredient_id': ing_id, 'measure': qty, 'units': unit,
+                                        'category_id': data['category_id']})
+    return final_shopping_list
+
+
+def synthetic_rows(n, ingredients):
+    unit_names = [row['name'] for row in UNIT_ROWS] + ['handful']
+    rows = []
+    for _ in range(n):
+        ing_id = random.randint(1, ingredients)
+        # Each ingredient mostly sticks to a couple of units, like real recipes
+        unit = unit_names[(ing_id * 7 + random.choice((0, 0, 0, 4))) % len(unit_names)]
+        rows.append({'ingredient_id': ing_id, 'measure': round(random.uniform(0.25, 500), 2),
+                     'units': unit, 'category_id': ing_id % 66})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--ingredients', type=int, default=1500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.rows, args.ingredients)
+    densities = {i: round(random.uniform(0.3, 1.5), 4) for i in range(1, args.ingredients + 1)}
+    units = {row['name']: {'category': row['category'], 'factor': float(row['factor'])} for row in UNIT_ROWS}
+
+    expected = original_consolidate(rows, densities)
+    result = consolidate_rows(rows, units=units, densities=densities)
+    same = len(expected) == len(result) and all(
+        a['ingredient_id'] == b['ingredient_id'] and a['units'] == b['units'] and a['category_id'] == b['category_id']
+        and (a['measure'] == b['measure'] or abs(a['measure'] - b['measure']) < 0.011)
+        for a, b in zip(expected, result))
+    print(f"{args.rows} rows -> {len(result)} lines, results match: {same}")
+
+    for label, func in (('original', lambda: original_consolidate(rows, densities)),
+                        ('vectorized', lambda: consolidate_rows(rows, units=units, densities=densities))):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            func()
+        print(f"{label:<11} {(time.perf_counter() - start) / args.repeat * 1000:8.2f} ms/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark of the CSV import paths in BaseModel.populate_from_csv.
+
+Each fixture in data/ is scaled up (its data rows repeated `--scale` times) and
+loaded into a scratch copy of its table (`Bench_<Table>`, created with
+CREATE TABLE ... LIKE, so no foreign keys) three ways:
+
+  - legacy:    the previous loader: every row held in memory, one executemany at the end
+  - streaming: populate_from_csv with chunked commits
+  - infile:    populate_from_csv(load_data_infile=True); needs local_infile=ON on the server
+
+Wall time and peak Python memory (tracemalloc) are printed per path.
+The scratch tables are dropped afterwards.
+
+Usage (from the project root, against a test database):
+    python benchmarks/bench_csv_loader.py --scale 100
+"""
+
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db_connector import create_connection
+from database.models import BaseModel, load_table_columns
+
+FIXTURES = [
+    ('Recipes', os.path.join('data', 'recipes_db_the_meal_db.csv')),
+    ('Ingredients', os.path.join('data', 'ingredients_db_the_meal_db.csv')),
+    ('Recipes_ingredients', os.path.join('data', 'recipe_ingredients_db_the_meal_db.csv')),
+]
+
+
+def scale_fixture(path, scale):
+    """Write a copy of the CSV with its data rows repeated `scale` times; returns the temp path."""
+    out = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8', newline='')
+    with open(path, encoding='utf-8', newline='') as f:
+        rows = list(csv.reader(f))
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(rows[0])
+    for _ in range(scale):
+        writer.writerows(rows[1:])
+    out.close()
+    return out.name
+
+
+def legacy_populate(file_path, table_name):
+    """The loader as it was before streaming: read everything, then one executemany."""
+    column_names = load_table_columns()[table_name.lower()]
+    db = create_connection()
+    cursor = db.cursor()
+    try:
+        with open(file_path, encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            reader.fieldnames = [name.strip() for name in reader.fieldnames]
+            cols_to_use = [col for col in column_names if col in reader.fieldnames and col != 'id']
+            sql = f"INSERT INTO {table_name} ({', '.join(cols_to_use)}) VALUES ({', '.join(['%s'] * len(cols_to_use))})"
+            rows_to_insert = [tuple(row[col].strip() if row.get(col) is not None else None for col in cols_to_use)
+                              for row in reader]
+        cursor.executemany(sql, rows_to_insert)
+        db.commit()
+        return len(rows_to_insert)
+    finally:
+        cursor.close()
+        db.close()
+
+
+def measure(label, func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        rows = func()
+    except Exception as e:
+        print(f"  {label:<10} failed: {e}")
+        return
+    finally:
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f"  {label:<10} {rows or 0:>9} rows  {elapsed:8.2f} s  peak {peak / 1_048_576:8.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=100)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    model = BaseModel('Recipes')
+    for table, path in FIXTURES:
+        bench_table = f"Bench_{table}"
+        scaled = scale_fixture(path, args.scale)
+        print(f"{table} x{args.scale} ({os.path.getsize(scaled) / 1_048_576:.1f} MiB)")
+        try:
+            model.run_query(f"DROP TABLE IF EXISTS {bench_table}")
+            model.run_query(f"CREATE TABLE {bench_table} LIKE {table}")
+            load_table_columns(refresh=True)
+
+            runs = [
+                ('legacy', lambda: legacy_populate(scaled, bench_table)),
+                ('streaming', lambda: model.populate_from_csv(scaled, bench_table, chunk_size=args.chunk_size,
+                                                              progress=lambda n: None)),
+                ('infile', lambda: model.populate_from_csv(scaled, bench_table, load_data_infile=True)),
+            ]
+            for label, func in runs:
+                model.run_query(f"TRUNCATE TABLE {bench_table}")
+                measure(label, func)
+        finally:
+            model.run_query(f"DROP TABLE IF EXISTS {bench_table}")
+            os.remove(scaled)
+
+
+if __name__ == "__main__":
+    main()
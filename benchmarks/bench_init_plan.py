@@ -0,0 +1,116 @@
+"""
+Benchmark of /init-plan's per-day path against the batch path (app.generate_plan).
+
+For 1, 3 and 7-day plans, both paths run `--runs` times inside a request scope
+(as in a Flask request), and the queries each one issued and the latency are
+reported. The per-day path repeats what init_plan did before the batch path:
+per day an existence check, fetch_menu_by_date, a Menus insert, and per meal
+slot a Meals lookup, a full recipe query and a Menu_meals insert. Menus are
+created a year ahead and deleted after every run.
+
+Usage (from the project root, against a database with recipes and a user):
+    python benchmarks/bench_init_plan.py --user-id 1 --runs 20
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import fetch_menu_by_date, generate_plan, meal_model, menu_meals_model, menu_model, recipe_model
+from database.db_connector import begin_request_scope, end_request_scope
+from database.instrumentation import begin_request_stats, end_request_stats
+
+MEALS = ['Breakfast', 'Morning Snack', 'Lunch', 'Afternoon Snack', 'Dinner', 'Evening Snack']
+
+
+def meal_column(meal_id):
+    """The old match_meal_to_recipe: a Meals lookup plus a scan of the Recipes columns."""
+    meal_name = meal_model.select_by_id(meal_id)['name']
+    for col in recipe_model.columns:
+        if meal_name.lower() in col.lower().replace('_', ' '):
+            return col
+    return None
+
+
+def per_day_plan(user_id, dates, selected_meals):
+    """The old init_plan loop, one day and one meal slot at a time."""
+    for current_date in dates:
+        if menu_model.run_query("SELECT id FROM Menus WHERE user_id = %s AND menu_date = %s", (user_id, current_date)):
+            raise RuntimeError(f"A menu for {current_date} already exists.")
+        fetch_menu_by_date(user_id, current_date)
+        menu_id = menu_model.insert({'user_id': user_id, 'menu_date': current_date})
+        used = []
+        for name in selected_meals:
+            meal = meal_model.run_query("SELECT id, default_time FROM Meals WHERE name = %s", (name,))[0]
+            col = meal_column(meal['id'])
+            recipe = random.choice(recipe_model.run_query(f"SELECT * FROM Recipes WHERE {col} = %s", (1,)))
+            used.append(recipe['id'])
+            menu_meals_model.insert({
+                'menu_id': menu_id, 'meal_id': meal['id'], 'recipe_id': recipe['id'],
+                'meal_time': meal['default_time'], 'regenerated_times': 0, 'if_picked_manually': 0
+            })
+
+
+def batch_plan(user_id, dates, selected_meals):
+    """Validation query of init_plan plus generate_plan."""
+    menu_model.run_query("""
+        SELECT SUM(menu_date > %s) as count,
+               MIN(CASE WHEN menu_date BETWEEN %s AND %s THEN menu_date END) as first_taken
+        FROM Menus
+        WHERE user_id = %s AND menu_date >= %s
+    """, (date.today(), dates[0], dates[-1], user_id, date.today()))
+    generate_plan(user_id, dates, selected_meals)
+
+
+def cleanup(user_id, dates):
+    with menu_model.transaction():
+        menu_model.run_query("""
+            DELETE mm FROM Menu_meals mm JOIN Menus m ON mm.menu_id = m.id
+            WHERE m.user_id = %s AND m.menu_date BETWEEN %s AND %s
+        """, (user_id, dates[0], dates[-1]))
+        menu_model.run_query("DELETE FROM Menus WHERE user_id = %s AND menu_date BETWEEN %s AND %s",
+                             (user_id, dates[0], dates[-1]))
+
+
+def measure(plan, user_id, dates, runs):
+    """Return (queries per run, ms per run)."""
+    queries, elapsed = 0, 0.0
+    for _ in range(runs):
+        begin_request_scope()
+        begin_request_stats('bench_init_plan')
+        start = time.perf_counter()
+        try:
+            plan(user_id, dates, MEALS)
+        finally:
+            elapsed += time.perf_counter() - start
+            queries += end_request_stats().count
+            end_request_scope()
+        cleanup(user_id, dates)
+    return queries / runs, elapsed / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--user-id', type=int, required=True)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    start = date.today() + timedelta(days=365)
+    print(f"{'days':>4} {'per-day queries':>16} {'per-day ms':>11} {'batch queries':>14} {'batch ms':>9}")
+    for days in (1, 3, 7):
+        dates = [start + timedelta(days=day) for day in range(days)]
+        cleanup(args.user_id, dates)
+        # Warm up the pools, the result cache and the recipe catalogue
+        measure(batch_plan, args.user_id, dates, 1)
+        old_queries, old_ms = measure(per_day_plan, args.user_id, dates, args.runs)
+        new_queries, new_ms = measure(batch_plan, args.user_id, dates, args.runs)
+        print(f"{days:>4} {old_queries:>16.0f} {old_ms:>11.1f} {new_queries:>14.0f} {new_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
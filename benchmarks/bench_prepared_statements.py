@@ -0,0 +1,77 @@
+"""
+Micro-benchmark of text vs. prepared execution for the hottest queries in app.py.
+
+Every query runs `--iterations` times on one pooled connection (as inside a
+Flask request): first through run_query's plain text protocol, then with
+prepared=True so the statement is parsed once and reused from the
+per-connection cache. Parameters are sampled from the existing rows.
+
+Usage (from the project root, against a database with some data in it):
+    python benchmarks/bench_prepared_statements.py --iterations 2000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db_connector import begin_request_scope, end_request_scope
+from database.models import BaseModel
+
+model = BaseModel('Recipes')
+
+MENU_MEALS_QUERY = """
+    SELECT mm.*, r.name as recipe_name, m.name as meal_type
+    FROM Menu_meals mm
+    JOIN Recipes r ON mm.recipe_id = r.id
+    JOIN Meals m ON mm.meal_id = m.id
+    WHERE mm.menu_id = %s
+    ORDER BY mm.meal_time ASC
+"""
+
+
+def sample(query, column, limit=200):
+    rows = model.run_query(query + f" LIMIT {limit}") or []
+    return [(row[column],) for row in rows] or [(0,)]
+
+
+def time_query(query, params_pool, iterations, prepared):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        model.run_query(query, random.choice(params_pool), prepared=prepared)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    queries = [
+        ('load_user', "SELECT * FROM Users WHERE id = %s", sample("SELECT id FROM Users", 'id')),
+        ('recipe by id', "SELECT * FROM Recipes WHERE id = %s", sample("SELECT id FROM Recipes", 'id')),
+        ('menu meals join', MENU_MEALS_QUERY, sample("SELECT id FROM Menus", 'id')),
+        ('ingredient by name', "SELECT id FROM Ingredients WHERE LOWER(name) = LOWER(%s)",
+         sample("SELECT name FROM Ingredients", 'name')),
+    ]
+
+    begin_request_scope()
+    try:
+        print(f"{'query':<20} {'text ms/q':>10} {'prepared ms/q':>14} {'speedup':>8}")
+        for label, query, params_pool in queries:
+            # Warm up both paths (and prepare the statement) before timing
+            model.run_query(query, params_pool[0])
+            model.run_query(query, params_pool[0], prepared=True)
+            text = time_query(query, params_pool, args.iterations, prepared=False)
+            prepared = time_query(query, params_pool, args.iterations, prepared=True)
+            print(f"{label:<20} {text / args.iterations * 1000:>10.3f} "
+                  f"{prepared / args.iterations * 1000:>14.3f} {text / prepared:>7.2f}x")
+    finally:
+        end_request_scope()
+
+
+if __name__ == "__main__":
+    main()
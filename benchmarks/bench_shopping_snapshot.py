@@ -0,0 +1,179 @@
+"""
+Benchmark of the first open of /shopping-list/<menu_id>: creating the list and
+snapshotting the menu's ingredients into it.
+
+The two paths compared are
+  * per item: what shopping_list did before. It inserts the header, reads the menu's
+    ingredients grouped per unit, consolidates them in Python (re-reading Units on every
+    call, as consolidate_by_ingredient did), then runs one INSERT and commit per item;
+  * snapshot: what it does now. It inserts the header and calls
+    shopping.snapshot.snapshot_menus (one INSERT ... SELECT) in one transaction.
+
+For each target size a temporary menu is built from random recipes until its
+ingredient lines reach the size. Both paths then create `--repeat` lists from it
+inside a request scope, as in app.py. The reported item count is the number of
+rows the snapshot actually wrote. The menus and lists are deleted afterwards.
+
+Usage (from the project root, against a database with recipes and a user):
+    python benchmarks/bench_shopping_snapshot.py --user-id 1 --sizes 5 50 500 --repeat 10
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.db_connector import begin_request_scope, end_request_scope
+from database.models import BaseModel
+from shopping.snapshot import snapshot_menus
+
+list_model = BaseModel('Shopping_list')
+items_model = BaseModel('Shopping_list_ingredients')
+menu_model = BaseModel('Menus')
+menu_meals_model = BaseModel('Menu_meals')
+
+# The grouping query and per-item insert shopping_list ran before snapshot_menus
+SELECT_ITEMS_SQL = """
+    SELECT
+        %s as shop_list_id,
+        ri.ingredient_id,
+        SUM(ri.measure) as measure,
+        u.name as units,
+        icm.category_id
+    FROM Recipes_ingredients ri
+    JOIN Menu_meals mm ON ri.recipe_id = mm.recipe_id
+    JOIN Units u ON ri.unit_id = u.id
+    LEFT JOIN Ingredients_categories_map icm ON ri.ingredient_id = icm.ingredient_id
+    WHERE mm.menu_id = %s
+    GROUP BY ri.ingredient_id, u.name, icm.category_id"""
+ITEM_SQL = """
+    INSERT INTO Shopping_list_ingredients (shop_list_id, ingredient_id, measure, units, category_id)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+def consolidate_by_ingredient(rows):
+    """The Python consolidation shopping_list used, Units query included."""
+    unit_rows = items_model.run_query("SELECT name, category, factor FROM Units")
+    unit_metadata = {row['name'].lower().strip(): {'category': row['category'], 'factor': float(row['factor'])}
+                     for row in unit_rows}
+    consolidated = {}
+    for row in rows:
+        ing_id = row['ingredient_id']
+        measure = float(row['measure'])
+        unit_name = row['units'].lower().strip()
+        data = consolidated.setdefault(ing_id, {'mass': 0.0, 'volume': 0.0, 'counts': {},
+                                                'category_id': row['category_id']})
+        u_info = unit_metadata.get(unit_name)
+        if not u_info or u_info['category'] == 'Count':
+            data['counts'][unit_name] = data['counts'].get(unit_name, 0) + measure
+        elif u_info['category'] == 'Mass':
+            data['mass'] += measure * u_info['factor']
+        elif u_info['category'] == 'Volume':
+            data['volume'] += measure * u_info['factor']
+        else:
+            data['counts'][unit_name] = "As required"
+    final_shopping_list = []
+    for ing_id, data in consolidated.items():
+        total_grams = data['mass'] + data['volume']
+        if total_grams >= 1000:
+            final_shopping_list.append({'ingredient_id': ing_id, 'measure': round(total_grams / 1000, 2),
+                                        'units': 'kg', 'category_id': data['category_id']})
+        elif total_grams > 0:
+            final_shopping_list.append({'ingredient_id': ing_id, 'measure': round(total_grams, 1),
+                                        'units': 'g', 'category_id': data['category_id']})
+        for unit, qty in data['counts'].items():
+            # The old column took "As required" as 0 too
+            final_shopping_list.append({'ingredient_id': ing_id, 'measure': qty if qty != "As required" else 0,
+                                        'units': unit, 'category_id': data['category_id']})
+    return final_shopping_list
+
+
+def build_menu(user_id, menu_date, size, recipe_lines, meal_id):
+    """A menu whose recipes add up to at least `size` ingredient lines."""
+    menu_id = menu_model.run_query("INSERT INTO Menus (user_id, menu_date) VALUES (%s, %s)", (user_id, menu_date))
+    recipes, lines = [], 0
+    for recipe_id, count in random.sample(recipe_lines, len(recipe_lines)):
+        if lines >= size:
+            break
+        recipes.append(recipe_id)
+        lines += count
+    menu_meals_model.insert_many([{'menu_id': menu_id, 'meal_id': meal_id, 'recipe_id': recipe_id,
+                                   'meal_time': '12:00:00', 'regenerated_times': 0} for recipe_id in recipes])
+    return menu_id
+
+
+def new_list(user_id, menu_id, label):
+    return list_model.run_query("INSERT INTO Shopping_list (name, user_id, menu_id) VALUES (%s, %s, %s)",
+                                (f"benchmark {label}", user_id, menu_id))
+
+
+def per_item(user_id, menu_id):
+    shop_list_id = new_list(user_id, menu_id, 'per item')
+    select_items = items_model.run_query(SELECT_ITEMS_SQL, (shop_list_id, menu_id))
+    for item in consolidate_by_ingredient(select_items):
+        items_model.run_query(ITEM_SQL, (shop_list_id, item['ingredient_id'], item['measure'],
+                                         item['units'], item['category_id']))
+    return shop_list_id
+
+
+def snapshot(user_id, menu_id):
+    with list_model.transaction():
+        shop_list_id = new_list(user_id, menu_id, 'snapshot')
+        snapshot_menus(shop_list_id, [menu_id])
+    return shop_list_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--user-id', type=int, required=True)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 50, 500])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    recipe_lines = [(row['recipe_id'], row['line_count']) for row in items_model.run_query(
+        "SELECT recipe_id, COUNT(*) AS line_count FROM Recipes_ingredients GROUP BY recipe_id") or []]
+    meals = items_model.run_query("SELECT id FROM Meals ORDER BY id LIMIT 1")
+    if not recipe_lines or not meals:
+        print("No recipes or meal types to build menus from.")
+        return
+
+    menus, lists = [], []
+    begin_request_scope()
+    try:
+        print(f"{'items':>6} {'per item ms':>12} {'snapshot ms':>12} {'speedup':>8}")
+        for i, size in enumerate(args.sizes):
+            menu_date = date.today() + timedelta(days=365 + i)
+            menu_id = build_menu(args.user_id, menu_date, size, recipe_lines, meals[0]['id'])
+            menus.append(menu_id)
+            timings = {}
+            for label, create in (('per item', per_item), ('snapshot', snapshot)):
+                runs = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    lists.append(create(args.user_id, menu_id))
+                    runs.append(time.perf_counter() - start)
+                timings[label] = statistics.median(runs) * 1000
+            items = items_model.run_query("SELECT COUNT(*) AS n FROM Shopping_list_ingredients WHERE shop_list_id = %s",
+                                          (lists[-1],))[0]['n']
+            print(f"{items:>6} {timings['per item']:>12.2f} {timings['snapshot']:>12.2f} "
+                  f"{timings['per item'] / timings['snapshot']:>7.1f}x")
+    finally:
+        if lists:
+            placeholders = ','.join(['%s'] * len(lists))
+            items_model.run_query(f"DELETE FROM Shopping_list_ingredients WHERE shop_list_id IN ({placeholders})", tuple(lists))
+            list_model.run_query(f"DELETE FROM Shopping_list WHERE id IN ({placeholders})", tuple(lists))
+        if menus:
+            placeholders = ','.join(['%s'] * len(menus))
+            menu_meals_model.run_query(f"DELETE FROM Menu_meals WHERE menu_id IN ({placeholders})", tuple(menus))
+            menu_model.run_query(f"DELETE FROM Menus WHERE id IN ({placeholders})", tuple(menus))
+        end_request_scope()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Most query results kept at once (least recently used are evicted first)
+MAX_ENTRIES = int(os.getenv('DB_RESULT_CACHE_SIZE', 512))
+
+_lock = threading.Lock()
+# Cached tables: {lower-cased table name: TTL in seconds}
+_ttls = {}
+# {(query, params): (expires_at, tables, rows)}
+_entries = OrderedDict()
+_stats = {}
+# {lower-cased table name: [callback(table)]}, see on_invalidate()
+_listeners = {}
+
+_READ_TABLES = re.compile(r"\b(?:from|join)\s+`?(\w+)`?", re.IGNORECASE)
+_COMMA_JOIN = re.compile(r"\bfrom\s+`?\w+`?(?:\s+(?:as\s+)?\w+)?\s*,", re.IGNORECASE)
+_WRITTEN_TABLE = re.compile(
+    r"^\s*(?:insert(?:\s+ignore)?\s+into|replace\s+into|update|delete\s+from|truncate(?:\s+table)?"
+    r"|alter\s+table|drop\s+table(?:\s+if\s+exists)?|load\s+data\b.*?\binto\s+table)\s+`?(\w+)`?",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def enable(table_name: str, ttl: float) -> None:
+    """Cache SELECT results that only read cached tables, for at most `ttl` seconds."""
+    with _lock:
+        _ttls[table_name.lower()] = ttl
+        _stats.setdefault(table_name.lower(), {'hits': 0, 'misses': 0, 'invalidations': 0})
+
+
+def on_invalidate(table_name: str, callback) -> None:
+    """Call `callback(table_name)` whenever a write to the table is seen, cached or not."""
+    _listeners.setdefault(table_name.lower(), []).append(callback)
+
+
+def _cacheable_tables(query: str):
+    """The cached tables a SELECT reads, or None if it reads anything uncached."""
+    if _COMMA_JOIN.search(query):
+        return None
+    tables = {name.lower() for name in _READ_TABLES.findall(query)}
+    if tables and all(table in _ttls for table in tables):
+        return tables
+    return None
+
+
+def _key(query: str, params):
+    """Cache key of a query, or None if its parameters can't be hashed."""
+    key = (query, tuple(params or ()))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def lookup(query: str, params):
+    """
+    Return a copy of the cached rows for this SELECT, or None on a miss or if the
+    query isn't cacheable. Rows are copied so callers can modify them freely.
+    """
+    tables = _cacheable_tables(query)
+    key = _key(query, params)
+    if tables is None or key is None:
+        return None
+    with _lock:
+        entry = _entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            _entries.move_to_end(key)
+            for table in tables:
+                _stats[table]['hits'] += 1
+            return [dict(row) for row in entry[2]]
+        for table in tables:
+            _stats[table]['misses'] += 1
+    return None
+
+
+def store(query: str, params, rows) -> None:
+    """Keep the rows of a cacheable SELECT until the shortest TTL of its tables expires."""
+    tables = _cacheable_tables(query)
+    key = _key(query, params)
+    if tables is None or key is None or rows is None:
+        return
+    with _lock:
+        expires_at = time.monotonic() + min(_ttls[table] for table in tables)
+        _entries[key] = (expires_at, tables, [dict(row) for row in rows])
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def invalidate_query(query: str) -> None:
+    """Invalidate whatever a write statement touches (everything, if its table can't be told)."""
+    match = _WRITTEN_TABLE.match(query)
+    if match:
+        invalidate(match.group(1))
+    else:
+        invalidate(None)
+
+
+def invalidate(table_name) -> None:
+    """Drop cached results that read `table_name` (all results if None) and notify listeners."""
+    table = table_name.lower() if table_name else None
+    # Results are only cached for enabled tables, so writes elsewhere have nothing to drop
+    if table is None or table in _ttls:
+        with _lock:
+            for key in [key for key, entry in _entries.items() if table is None or table in entry[1]]:
+                del _entries[key]
+            if table in _stats:
+                _stats[table]['invalidations'] += 1
+    callbacks = _listeners.get(table, []) if table else [cb for cbs in _listeners.values() for cb in cbs]
+    for callback in callbacks:
+        try:
+            callback(table_name)
+        except Exception as e:
+            print(f"Cache listener error: {e}")
+
+
+def stats() -> dict:
+    """Hit/miss/invalidation counts per cached table, plus the current entry count."""
+    with _lock:
+        return {'entries': len(_entries), 'tables': {table: dict(counts) for table, counts in _stats.items()}}
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+
+# Queries slower than this are written to the slow-query log
+SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', 200))
+# One request running the same query shape more often than this is flagged as N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv('DB_N_PLUS_ONE_THRESHOLD', 10))
+
+slow_query_log = logging.getLogger('menu_generator.slow_queries')
+n_plus_one_log = logging.getLogger('menu_generator.n_plus_one')
+
+_hooks = []
+_state = threading.local()
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|%\(\w+\)s")
+_IN_LIST = re.compile(r"\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(query: str) -> str:
+    """
+    Normalize a query to its shape: literals and placeholders become '?', IN lists
+    collapse to 'in (?+)', whitespace and case are folded. Queries that differ only
+    in their values share a fingerprint.
+    """
+    shape = _STRING_LITERAL.sub('?', query)
+    shape = _PLACEHOLDER.sub('?', shape)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    shape = _WHITESPACE.sub(' ', shape).strip().lower()
+    return _IN_LIST.sub('in (?+)', shape)
+
+
+class RequestStats:
+    """Queries run while handling one request (or one script run)."""
+
+    def __init__(self, route=None):
+        self.route = route
+        self.count = 0
+        self.total_ms = 0.0
+        self.by_fingerprint = Counter()
+        self.n_plus_one = set()
+
+    def summary(self) -> str:
+        """Short one-line summary, e.g. for a debug response header."""
+        text = f"queries={self.count}; time_ms={self.total_ms:.1f}"
+        if self.n_plus_one:
+            text += f"; n_plus_one={len(self.n_plus_one)}"
+        return text
+
+
+def register_hook(func) -> None:
+    """
+    Call `func(event)` after every query. `event` is a dict with fingerprint, query,
+    duration_ms, row_count and route.
+    """
+    _hooks.append(func)
+
+
+def begin_request_stats(route=None) -> None:
+    """Start collecting per-request query statistics on this thread."""
+    _state.stats = RequestStats(route)
+
+
+def current_request_stats():
+    """Statistics of the request being handled on this thread, or None."""
+    return getattr(_state, 'stats', None)
+
+
+def end_request_stats():
+    """Stop collecting and return the finished RequestStats (or None)."""
+    stats = current_request_stats()
+    _state.stats = None
+    return stats
+
+
+def record_query(query: str, started: float, row_count) -> None:
+    """
+    Record a finished query. Called by BaseModel after each execution.
+    Args:
+        query (str): The SQL text.
+        started (float): time.perf_counter() taken just before execution.
+        row_count (int): Rows returned (SELECT) or affected (writes).
+    """
+    duration_ms = (time.perf_counter() - started) * 1000
+    stats = current_request_stats()
+    route = stats.route if stats else None
+    shape = fingerprint(query)
+
+    if stats:
+        stats.count += 1
+        stats.total_ms += duration_ms
+        stats.by_fingerprint[shape] += 1
+        if stats.by_fingerprint[shape] > N_PLUS_ONE_THRESHOLD and shape not in stats.n_plus_one:
+            stats.n_plus_one.add(shape)
+            n_plus_one_log.warning(json.dumps({
+                'event': 'n_plus_one',
+                'route': route,
+                'fingerprint': shape,
+                'threshold': N_PLUS_ONE_THRESHOLD,
+            }))
+
+    if duration_ms >= SLOW_QUERY_MS:
+        slow_query_log.warning(json.dumps({
+            'event': 'slow_query',
+            'route': route,
+            'fingerprint': shape,
+            'duration_ms': round(duration_ms, 2),
+            'row_count': row_count,
+        }))
+
+    if _hooks:
+        event = {
+            'fingerprint': shape,
+            'query': query,
+            'duration_ms': duration_ms,
+            'row_count': row_count,
+            'route': route,
+        }
+        for hook in _hooks:
+            try:
+                hook(event)
+            except Exception as e:
+                print(f"Query hook error: {e}")
@@ -0,0 +1,6 @@
+-- One menu per user and date, so background pre-generation can't create a
+-- duplicate draft (it relies on INSERT IGNORE against this key). init_plan replaces
+-- unsubmitted drafts on the dates it plans instead of treating them as taken.
+-- Check for existing duplicates first; the ALTER fails while any remain:
+--   SELECT user_id, menu_date, COUNT(*) FROM Menus GROUP BY user_id, menu_date HAVING COUNT(*) > 1;
+ALTER TABLE `Menus` ADD UNIQUE KEY `uniq_menus_user_date` (`user_id`, `menu_date`);
@@ -0,0 +1,4 @@
+-- Per-list version counter for the item PATCH API: every item change bumps it,
+-- and a change sent with an older version is rejected (409) instead of
+-- overwriting a collaborator's edit. Existing lists start at version 0.
+ALTER TABLE `Shopping_list` ADD COLUMN `version` INT UNSIGNED NOT NULL DEFAULT 0 AFTER `menu_id`;
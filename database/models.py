@@ -1,66 +1,304 @@
 import csv
-from .db_connector import create_connection
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from mysql.connector.pooling import PooledMySQLConnection
+from . import cache
+from .db_connector import (after_commit, create_connection, create_stream_connection, get_connection,
+                           in_transaction, note_write, transaction)
+from .instrumentation import record_query
+
+# Column names of every table in the schema, keyed by lower-cased table name.
+# Loaded with a single information_schema query the first time any model needs it.
+_table_columns = None
+_table_columns_lock = threading.Lock()
+
+
+def load_table_columns(refresh=False) -> dict:
+    """
+    Return {table_name: [column names in table order]} for the current database.
+    Args:
+        refresh (bool, optional): Re-read the schema instead of using the cached copy
+            (e.g. after setup_db.py or a migration changed the tables).
+    Returns: The column map, or an empty dict if the database is unavailable."""
+    global _table_columns
+    with _table_columns_lock:
+        if _table_columns is not None and not refresh:
+            return _table_columns
+
+        db = create_connection()
+        if not db:
+            print("No database available.")
+            return {}
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name
+                FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE()
+                ORDER BY TABLE_NAME, ORDINAL_POSITION
+            """)
+            columns = {}
+            for row in cursor.fetchall():
+                columns.setdefault(row['table_name'].lower(), []).append(row['column_name'])
+            _table_columns = columns
+        except Exception as e:
+            print(f"Query Error: {e}")
+            return {}
+        finally:
+            cursor.close()
+            db.close()
+        return _table_columns
+
+
+# Prepared statements, cached per physical pooled connection and keyed by SQL text:
+# {connection: (connection_id, OrderedDict(sql -> prepared cursor))}, least recently used first.
+_statement_caches = weakref.WeakKeyDictionary()
+STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 32))
+
+
+def _prepared_cursor(db, query):
+    """
+    Return a prepared cursor for `query` on this connection, preparing it only the first time.
+    Returns: (cursor, cached). Uncached cursors (direct, non-pooled connections) must be closed by the caller."""
+    if not isinstance(db, PooledMySQLConnection):
+        return db.cursor(prepared=True, dictionary=True), False
+
+    cnx = db._cnx  # the physical connection behind the pool wrapper
+    cache = _statement_caches.get(cnx)
+    if cache is None or cache[0] != cnx.connection_id:
+        # New connection, or the pool reconnected it and the old statements are gone
+        cache = (cnx.connection_id, OrderedDict())
+        _statement_caches[cnx] = cache
+    statements = cache[1]
+
+    cursor = statements.get(query)
+    if cursor is not None:
+        statements.move_to_end(query)
+        return cursor, True
+
+    cursor = db.cursor(prepared=True, dictionary=True)
+    statements[query] = cursor
+    if len(statements) > STATEMENT_CACHE_SIZE:
+        _, oldest = statements.popitem(last=False)
+        try:
+            oldest.close()  # deallocates the statement on the server
+        except Exception:
+            pass
+    return cursor, True
+
+
+def _forget_prepared(db, query) -> None:
+    """Drop a cached statement that failed so it is prepared afresh next time."""
+    cache = _statement_caches.get(db._cnx) if isinstance(db, PooledMySQLConnection) else None
+    cursor = cache[1].pop(query, None) if cache else None
+    if cursor is not None:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+def _invalidate_written(query) -> None:
+    """Drop cached results for the table a write statement changed."""
+    cache.invalidate_query(query)
+    if in_transaction():
+        # Other threads may re-cache the old rows until the commit, so invalidate once more then
+        after_commit(lambda: cache.invalidate_query(query))
 
 
 class BaseModel:
     """Base model to provide database db."""
 
-    def __init__(self, table_name):
+    def __init__(self, table_name, cache_ttl=None):
+        """
+        Args:
+            table_name (str): The table this model reads and writes.
+            cache_ttl (float, optional): Opt in to result caching for this table: SELECTs that
+                only read cached tables are served from memory for up to `cache_ttl` seconds.
+                Writes seen by this process invalidate them immediately; the TTL bounds how
+                stale they can get after writes from other processes. Meant for reference tables.
+        """
         self.table_name = table_name
-        self.columns = []
-        self.fetch_column_names()
+        if cache_ttl:
+            cache.enable(table_name, cache_ttl)
+
+    @property
+    def columns(self) -> list:
+        """Column names of the table (empty if it doesn't exist yet, e.g. before setup_db.py runs)."""
+        return list(load_table_columns().get(self.table_name.lower(), []))
 
     def fetch_column_names(self) -> None:
-        """Fetch column names once and close connection immediately."""
-        db = create_connection()
-        if db:
-            cursor = db.cursor(dictionary=True)
-            try:
-                # We use a direct cursor here to keep the logic contained
-                cursor.execute(f"DESCRIBE {self.table_name}")
-                results = cursor.fetchall()
-                self.columns = [row['Field'] for row in results]
-            except Exception:
-                # Table might not exist yet during the very first run of setup_db.py
-                self.columns = []
-            finally:
-                cursor.close()
-                db.close()
+        """Reload the cached column names of all tables."""
+        load_table_columns(refresh=True)
 
-    def run_query(self, query, params:tuple = ()):
+    def run_query(self, query, params:tuple = (), prepared=False):
         """
         Run a given SQL query with optional parameters.
         Args:
             query (str): The SQL query to execute.
             params (tuple, optional): Parameters for the SQL query. Defaults to None.
+            prepared (bool, optional): Run it as a server-side prepared statement, cached
+                on the connection so repeated calls skip parsing. Use for hot queries.
         Returns: The result of the query, if inserting, returns last inserted ID."""
-        db = create_connection()
+        # Plain SELECTs may be served by a read replica; everything else goes to the primary
+        is_select = query.strip().upper().startswith("SELECT")
+        # Reads inside a transaction may see its uncommitted writes, so they bypass the cache
+        use_cache = is_select and not in_transaction()
+        if use_cache:
+            results = cache.lookup(query, params)
+            if results is not None:
+                return results
+        db, owned = get_connection(read=is_select and 'FOR UPDATE' not in query.upper())
         if db:
-            cursor = db.cursor(dictionary=True)
+            if prepared:
+                # The connector only reuses a prepared statement for the *same* string
+                # object, so equal SQL texts are interned to one object
+                query = sys.intern(query)
+                cursor, cached = _prepared_cursor(db, query)
+            else:
+                cursor, cached = db.cursor(dictionary=True), False
             try:
+                started = time.perf_counter()
                 cursor.execute(query, params or ())
-                if query.strip().upper().startswith("SELECT"):
+                if is_select:
                     results = cursor.fetchall()
+                    record_query(query, started, len(results))
+                    if use_cache:
+                        cache.store(query, params, results)
                 else:
                     # COMMIT the changes so they are visible to other queries
-                    db.commit()
+                    # (inside transaction() the commit happens once, when the block exits)
+                    if not in_transaction():
+                        db.commit()
+                    note_write()
+                    _invalidate_written(query)
+                    record_query(query, started, cursor.rowcount)
                     # RETURN the last inserted ID for Foreign Key use
                     results = cursor.lastrowid # int
                 return results
             except Exception as e:
                 print(f"Query Error: {e}")
+                if cached:
+                    _forget_prepared(db, query)
+                if in_transaction():
+                    # Let transaction() roll back the whole unit of work
+                    raise
                 return None
             finally:
                 # print(f"query executed: {query}")
                 # print(f"with params: {params}")
                 # print('Closing connection')
                 # print('-'*20)
-                cursor.close()
-                db.close()
+                if not cached:
+                    cursor.close()
+                if owned:
+                    db.close()
         else:
             print("No database available.")
             return None
         
+    def iter_query(self, query, params: tuple = (), batch_size: int = 500, batches: bool = False):
+        """
+        Stream the result of a SELECT instead of loading it all into a list.
+        Runs on its own pooled connection with an unbuffered cursor, so rows come
+        from the server as they are consumed and other queries can run meanwhile.
+        The connection is routed like other reads, so a stream that starts right after
+        a write reads from the primary.
+        Args:
+            query (str): The SELECT to execute.
+            params (tuple, optional): Parameters for the SQL query.
+            batch_size (int, optional): Rows fetched from the server at a time. Defaults to 500.
+            batches (bool, optional): Yield lists of up to batch_size rows instead of single rows.
+        Yields: Row dicts (or lists of them)."""
+        db = create_stream_connection()
+        if not db:
+            print("No database available.")
+            return
+        cursor = db.cursor(dictionary=True, buffered=False)
+        started = time.perf_counter()
+        row_count = 0
+        try:
+            cursor.execute(query, params or ())
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                row_count += len(rows)
+                if batches:
+                    yield rows
+                else:
+                    yield from rows
+        except Exception as e:
+            print(f"Query Error: {e}")
+        finally:
+            try:
+                # If the caller stopped early, discard the unread rows batch by batch
+                # so the connection can go back to the pool
+                while cursor.fetchmany(batch_size):
+                    pass
+            except Exception:
+                pass
+            record_query(query, started, row_count)
+            cursor.close()
+            db.close()
+
+    def run_many(self, query, params_list: list):
+        """
+        Run one write statement for many parameter tuples with a single executemany().
+        For INSERTs mysql.connector sends one multi-row INSERT ... VALUES (...), (...).
+        Args:
+            query (str): The SQL statement to execute.
+            params_list (list): One parameter tuple per row.
+        Returns: (first inserted ID, number of affected rows), or None on error."""
+        if not params_list:
+            return None
+        db, owned = get_connection()
+        if db:
+            cursor = db.cursor()
+            try:
+                started = time.perf_counter()
+                cursor.executemany(query, params_list)
+                if not in_transaction():
+                    db.commit()
+                note_write()
+                _invalidate_written(query)
+                record_query(query, started, cursor.rowcount)
+                return cursor.lastrowid, cursor.rowcount
+            except Exception as e:
+                print(f"Query Error: {e}")
+                if in_transaction():
+                    raise
+                return None
+            finally:
+                cursor.close()
+                if owned:
+                    db.close()
+        else:
+            print("No database available.")
+            return None
+
+    @staticmethod
+    def cache_stats() -> dict:
+        """Result-cache hits, misses and invalidations per cached table."""
+        return cache.stats()
+
+    def transaction(self):
+        """
+        Group several queries into one unit of work:
+
+            with model.transaction():
+                model.run_query(...)
+                other_model.insert(...)
+
+        All statements in the block run on one connection and are committed once;
+        a failing statement rolls back everything and the exception is re-raised.
+        """
+        return transaction()
+
     def delete_all(self):
         """Delete all records from the table."""
         query = f"DELETE FROM {self.table_name}"
@@ -79,20 +317,41 @@ class BaseModel:
         query = f"INSERT INTO {self.table_name} ({columns}) VALUES ({placeholders})"
         return self.run_query(query, values)
     
-    def insert_many(self, data_list: list):
-        """Insert multiple records into the table."""
-        new_ids = []
+    def insert_many(self, data_list: list, chunk_size: int = 500):
+        """
+        Insert multiple records with one multi-row INSERT per chunk, all in a single transaction.
+        Args:
+            data_list (list): Dicts with the same keys, all table columns (excluding 'id');
+                columns left out get their defaults.
+            chunk_size (int, optional): Rows per INSERT statement. Defaults to 500.
+        Returns: The generated IDs, derived from each chunk's first ID and row count
+        (InnoDB hands out consecutive IDs within one multi-row INSERT), or None on error."""
+        if not data_list:
+            return []
+        keys = list(data_list[0].keys())
+        model_columns = self.columns[1:]  # Exclude 'id'
+        if not set(keys) <= set(model_columns):
+            print(f"Error: Data keys {keys} do not match model columns {model_columns}")
+            return None
         for data in data_list:
-            if list(data.keys()) != self.columns[1:]:  # Exclude 'id'
-                print(f"Error: Data keys {list(data.keys())} do not match model columns {self.columns[1:]}")
+            if list(data.keys()) != keys:
+                print(f"Error: Data keys {list(data.keys())} do not match model columns {model_columns}")
                 return None
-            else:
-                columns = ', '.join(data_list[0].keys())
-                placeholders = ', '.join(['%s'] * len(data_list[0]))
-                query = f"INSERT INTO {self.table_name} ({columns}) VALUES ({placeholders})"
-                values = tuple(data.values())
-                new_id = self.run_query(query, values)
-                new_ids.append(new_id)
+
+        columns = ', '.join(keys)
+        placeholders = ', '.join(['%s'] * len(keys))
+        query = f"INSERT INTO {self.table_name} ({columns}) VALUES ({placeholders})"
+
+        new_ids = []
+        try:
+            with self.transaction():
+                for start in range(0, len(data_list), chunk_size):
+                    chunk = [tuple(data.values()) for data in data_list[start:start + chunk_size]]
+                    first_id, count = self.run_many(query, chunk)
+                    new_ids.extend(range(first_id, first_id + count))
+        except Exception as e:
+            print(f"Insert Error: {e}")
+            return None
         return new_ids
     
     def update(self, record_id, data: dict):
@@ -105,7 +364,7 @@ class BaseModel:
     def select_by_id(self, record_id):
         """Retrieve a record by its ID."""
         query = f"SELECT * FROM {self.table_name} WHERE id = %s"
-        results = self.run_query(query, (record_id,))
+        results = self.run_query(query, (record_id,), prepared=True)
         return results[0] if results else None
     
     def select_all(self):
@@ -118,24 +377,42 @@ class BaseModel:
         where_clause = ' AND '.join([f"{key} = %s" for key in conditions.keys()])
         values = tuple(conditions.values())
         query = f"SELECT * FROM {self.table_name} WHERE {where_clause}"
-        return self.run_query(query, values)
+        return self.run_query(query, values, prepared=True)
     
-    def populate_from_csv(self, file_path, table_name, delimiter=',', encoding='utf-8'):
+    def populate_from_csv(self, file_path, table_name, delimiter=',', encoding='utf-8',
+                          chunk_size=1000, progress=None, load_data_infile=False):
         """
-        Reads a CSV and inserts data based on the columns 
-        defined in the child class (e.g., self.columns).
+        Streams a CSV into the table, inserting the columns that exist both in
+        the table and in the CSV header ('id' is left to auto-increment).
+        Rows are read lazily and committed in chunks of `chunk_size`, so memory
+        stays bounded however large the file is.
+        Args:
+            chunk_size (int, optional): Rows per multi-row INSERT and commit. Defaults to 1000.
+            progress (callable, optional): Called with the running row count after each chunk.
+                Defaults to printing it.
+            load_data_infile (bool, optional): Hand the whole file to the server with
+                LOAD DATA LOCAL INFILE instead. Much faster, but only use it for trusted
+                files; the server must have local_infile enabled.
+        Returns: Number of imported rows, or None on error.
         """
+        column_names = load_table_columns().get(table_name.lower())
+        if not column_names:
+            print(f"❌ Error: Table '{table_name}' not found.")
+            return None
+        print(f"Table '{table_name}' columns: {column_names}")
+        progress = progress or (lambda n: print(f"  ... {n} rows imported into {table_name}"))
+
+        print(f"Importing data from {file_path} into {table_name}...")
+        if load_data_infile:
+            return self._load_data_infile(file_path, table_name, column_names, delimiter, encoding)
+
         db = create_connection()
-        if db:
-            cursor = db.cursor()
-            cursor.execute(f"DESCRIBE {table_name}")
-            column_names = [col[0] for col in cursor.fetchall()]
-            print(f"Table '{table_name}' columns: {column_names}")
-        else:
+        if not db:
             print("No database available.")
-
+            return None
+        cursor = db.cursor()
+        imported = 0
         try:
-            print(f"Importing data from {file_path} into {table_name}...")
             with open(file_path, mode='r', encoding=encoding) as f:
                 reader = csv.DictReader(f, delimiter=delimiter)
                 # Clean headers to avoid hidden space issues
@@ -143,41 +420,103 @@ class BaseModel:
                 reader.fieldnames = csv_headers
 
                 # 1. FIND THE INTERSECTION
-                # We only use columns that are both in your Model AND in the CSV
+                # We only use columns that are both in the table AND in the CSV
                 # (Excluding 'id' because it's auto-increment)
                 cols_to_use = [col for col in column_names if col in csv_headers and col != 'id']
-                    
+
                 if not cols_to_use:
                     print(f"❌ Error: No matching columns found between Model and CSV.")
-                    return 
+                    return None
 
                 # 2. DYNAMICALLY BUILD THE SQL
                 columns_str = ", ".join(cols_to_use)
                 placeholders = ", ".join(["%s"] * len(cols_to_use))
                 sql = f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders})"
 
-                rows_to_insert = []
+                # 3. STREAM THE ROWS, committing one chunk at a time
+                chunk = []
                 for row in reader:
-                    # --- PASTE THE FIX HERE ---
-                    values = []
-                    for col in cols_to_use:
-                        val = row.get(col)
-                        # val.strip() removes hidden spaces; 
-                        # 'if val is not None' prevents crashing on empty cells
-                        values.append(val.strip() if val is not None else None)
-                    
-                    rows_to_insert.append(tuple(values))
-                if rows_to_insert:
-                    cursor.executemany(sql, rows_to_insert)
+                    # val.strip() removes hidden spaces;
+                    # 'if val is not None' prevents crashing on empty cells
+                    chunk.append(tuple(
+                        row[col].strip() if row.get(col) is not None else None
+                        for col in cols_to_use
+                    ))
+                    if len(chunk) >= chunk_size:
+                        cursor.executemany(sql, chunk)
+                        db.commit()
+                        imported += len(chunk)
+                        chunk = []
+                        progress(imported)
+                if chunk:
+                    cursor.executemany(sql, chunk)
                     db.commit()
-                    print(f"✅ Successfully imported {len(rows_to_insert)} rows into {table_name}")
-                    # print(f"Columns used: {cols_to_use}")
+                    imported += len(chunk)
+                    progress(imported)
+
+            print(f"✅ Successfully imported {imported} rows into {table_name}")
+            return imported
 
+        except Exception as e:
+            # Chunks committed before the error stay in the table
+            print(f"❌ CSV Import Error after {imported} rows: {e}")
+            db.rollback()
+            return None
+        finally:
+            cursor.close()
+            db.close()
+            if imported:
+                cache.invalidate(table_name)
+
+    def _load_data_infile(self, file_path, table_name, column_names, delimiter, encoding):
+        """Import a trusted CSV in one LOAD DATA LOCAL INFILE statement."""
+        with open(file_path, mode='r', encoding=encoding, newline='') as f:
+            first_line = f.readline()
+            csv_headers = [name.strip() for name in next(csv.reader([first_line], delimiter=delimiter))]
+        line_end = '\\r\\n' if first_line.endswith('\r\n') else '\\n'
+
+        # CSV columns that aren't in the table are read into a throwaway variable;
+        # the rest are trimmed like in the streaming path
+        targets, assignments = [], []
+        for i, header in enumerate(csv_headers):
+            if header in column_names and header != 'id':
+                targets.append(f"@v{i}")
+                assignments.append(f"{header} = TRIM(@v{i})")
+            else:
+                targets.append("@skip")
+        if not assignments:
+            print(f"❌ Error: No matching columns found between Model and CSV.")
+            return None
+
+        charset = 'utf8mb4' if encoding.lower().replace('-', '') in ('utf8', 'utf8sig') else 'latin1'
+        sql = f"""
+            LOAD DATA LOCAL INFILE %s INTO TABLE {table_name}
+            CHARACTER SET {charset}
+            FIELDS TERMINATED BY %s OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+            LINES TERMINATED BY '{line_end}'
+            IGNORE 1 LINES
+            ({', '.join(targets)})
+            SET {', '.join(assignments)}
+        """
+        db = create_connection(allow_local_infile=True)
+        if not db:
+            print("No database available.")
+            return None
+        cursor = db.cursor()
+        try:
+            cursor.execute(sql, (os.path.abspath(file_path), delimiter))
+            db.commit()
+            cache.invalidate(table_name)
+            print(f"✅ Successfully imported {cursor.rowcount} rows into {table_name}")
+            return cursor.rowcount
         except Exception as e:
             print(f"❌ CSV Import Error: {e}")
             db.rollback()
+            return None
         finally:
             cursor.close()
             db.close()
+
+
 if __name__ == "__main__":    # Example usage
     pass
\ No newline at end of file
@@ -93,7 +93,8 @@ CREATE TABLE `Menus`(
     `user_id` BIGINT UNSIGNED NOT NULL,
     `menu_date` DATE NOT NULL,
     `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    `submitted_at` TIMESTAMP NULL
+    `submitted_at` TIMESTAMP NULL,
+    UNIQUE KEY `uniq_menus_user_date` (`user_id`, `menu_date`)
 );
 CREATE TABLE `Meals`(
     `id` SMALLINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
@@ -153,6 +154,7 @@ CREATE TABLE `Shopping_list`(
     `name` VARCHAR(255) NOT NULL DEFAULT 'My Shopping List',
     `user_id` BIGINT UNSIGNED NULL,
     `menu_id` BIGINT UNSIGNED NULL,
+    `version` INT UNSIGNED NOT NULL DEFAULT 0 COMMENT 'bumped on every item change, for optimistic concurrency between collaborators',
     `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -0,0 +1,246 @@
+import os
+import random
+import threading
+import time
+from array import array
+
+from database import cache
+from database.models import BaseModel
+from .alias import AliasTable
+
+# Writes in other processes aren't seen by the invalidation hook, so reload after this long anyway
+CATALOGUE_MAX_AGE = float(os.getenv('RECIPE_CATALOGUE_MAX_AGE', 300))
+
+# Meal-type flag columns of Recipes
+MEAL_FLAGS = (
+    'if_breakfast', 'if_lunch', 'if_dinner',
+    'if_morning_snack', 'if_afternoon_snack', 'if_evening_snack',
+)
+
+
+def rating_weight(rating) -> float:
+    """Sampling weight of a recipe rating; unrated or zero-rated recipes keep a small chance."""
+    return 1.0 + max(rating or 0, 0)
+
+
+def _minutes(value) -> float:
+    """Minutes in a TIME column value (a timedelta from the driver)."""
+    return value.total_seconds() / 60 if value is not None else 0.0
+
+
+class _Snapshot:
+    """One load of the catalogue. Per-flag sets and alias tables are built on first use."""
+
+    def __init__(self, ids, ratings, minutes, categories):
+        self.ids = ids
+        self.ratings = ratings
+        self.minutes = minutes
+        self.categories = categories
+        self.members = {}
+        self.tables = {}
+        self.quickest = {}
+
+    def carry_over(self, old) -> set:
+        """
+        Take over the per-flag sets and alias tables of an older snapshot for the flags
+        whose recipes and ratings didn't change, so only those flags are rebuilt.
+        Returns the ids of the recipes added, removed, re-rated or re-flagged since `old`.
+        """
+        changed = {recipe_id for recipe_id, rating in self.ratings.items() if old.ratings.get(recipe_id, rating) != rating}
+        changed |= self.ratings.keys() ^ old.ratings.keys()
+        for flag, ids in self.ids.items():
+            if ids != old.ids.get(flag):
+                changed |= set(ids).symmetric_difference(old.ids.get(flag, ()))
+        for flag, ids in self.ids.items():
+            if ids == old.ids.get(flag) and changed.isdisjoint(ids):
+                if flag in old.members:
+                    self.members[flag] = old.members[flag]
+                if flag in old.tables:
+                    self.tables[flag] = old.tables[flag]
+        return changed
+
+
+class RecipeCatalogue:
+    """
+    Process-wide index of recipe ids by meal-type flag, so picking a recipe
+    doesn't mean fetching every matching row. Loaded on first use with one
+    narrow query and reloaded after any write to Recipes (or CATALOGUE_MAX_AGE).
+    A write only names the table, so the reload reads every row again, but the alias
+    tables of flags the write didn't touch are kept and on_change() listeners learn
+    which recipes changed.
+    """
+
+    def __init__(self, model=None):
+        self.model = model or BaseModel('Recipes')
+        self._lock = threading.Lock()
+        # Replaced as a whole on reload; the previous one is kept to diff against
+        self._data = None
+        self._stale = False
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._listeners = []
+        cache.on_invalidate('Recipes', self.invalidate)
+
+    def invalidate(self, table_name=None) -> None:
+        """Reload on next use."""
+        self._generation += 1
+        self._stale = True
+
+    def on_change(self, callback) -> None:
+        """Call `callback(recipe_ids)` after a reload with the ids of the recipes that changed."""
+        self._listeners.append(callback)
+
+    def refresh(self) -> None:
+        """Apply a pending reload now, so on_change() listeners have run."""
+        self._snapshot()
+
+    def _load(self):
+        """A fresh snapshot, or None if the query failed (database unreachable)."""
+        rows = self.model.run_query(f"""
+            SELECT id, rating, prep_time, cooking_time, category_id, {', '.join(MEAL_FLAGS)}
+            FROM Recipes ORDER BY id
+        """)
+        if rows is None:
+            return None
+        ids = {flag: array('Q') for flag in MEAL_FLAGS}
+        ratings, minutes, categories = {}, {}, {}
+        for row in rows:
+            ratings[row['id']] = row['rating']
+            minutes[row['id']] = _minutes(row['prep_time']) + _minutes(row['cooking_time'])
+            categories[row['id']] = row['category_id']
+            for flag in MEAL_FLAGS:
+                if row[flag]:
+                    ids[flag].append(row['id'])
+        return _Snapshot(ids, ratings, minutes, categories)
+
+    def _due(self, data) -> bool:
+        return data is None or self._stale or time.monotonic() - self._loaded_at > CATALOGUE_MAX_AGE
+
+    def _snapshot(self) -> _Snapshot:
+        data = self._data
+        if not self._due(data):
+            return data
+        with self._lock:
+            data = self._data
+            if not self._due(data):
+                return data
+            generation = self._generation
+            loaded = self._load()
+            if loaded is None:
+                # Not cached, so the next call retries: keep serving the old snapshot if any
+                return data or _Snapshot({flag: array('Q') for flag in MEAL_FLAGS}, {}, {}, {})
+            changed = loaded.carry_over(data) if data is not None else None
+            self._data = loaded
+            # A write during the load may be missing from it: use it, but reload next time
+            self._stale = generation != self._generation
+            self._loaded_at = time.monotonic()
+        if changed is None or changed:
+            for callback in self._listeners:
+                callback(changed)
+        return loaded
+
+    def ids_for(self, flag: str):
+        """Ids of the recipes suitable for a meal-type flag (e.g. 'if_lunch')."""
+        return self._snapshot().ids.get(flag, array('Q'))
+
+    def has(self, flag: str, recipe_id) -> bool:
+        """True if the recipe is suitable for the meal-type flag."""
+        data = self._snapshot()
+        if flag not in data.members:
+            data.members[flag] = frozenset(data.ids.get(flag, ()))
+        return recipe_id in data.members[flag]
+
+    def rating(self, recipe_id):
+        """Rating of a recipe, or None if it isn't in the catalogue."""
+        return self._snapshot().ratings.get(recipe_id)
+
+    def minutes(self, recipe_id) -> float:
+        """Prep plus cooking time of a recipe in minutes (0 if it isn't in the catalogue)."""
+        return self._snapshot().minutes.get(recipe_id, 0.0)
+
+    def quickest(self, flag: str) -> float:
+        """Prep plus cooking minutes of the quickest recipe for a meal-type flag (0 if none)."""
+        data = self._snapshot()
+        if flag not in data.quickest:
+            data.quickest[flag] = min((data.minutes[i] for i in data.ids.get(flag, ())), default=0.0)
+        return data.quickest[flag]
+
+    def category(self, recipe_id):
+        """Category id of a recipe, or None if it isn't in the catalogue."""
+        return self._snapshot().categories.get(recipe_id)
+
+    def rating_table(self, flag: str):
+        """
+        Alias table drawing the recipes of a meal-type flag in proportion to their
+        rating (see rating_weight). Built once per flag and catalogue load; None if empty.
+        """
+        data = self._snapshot()
+        if flag not in data.tables:
+            ids = data.ids.get(flag)
+            data.tables[flag] = AliasTable(ids, [rating_weight(data.ratings[i]) for i in ids]) if ids else None
+        return data.tables[flag]
+
+    def sample(self, flag: str, exclude=()):
+        """
+        Pick a random recipe id for a meal-type flag, avoiding the ids in `exclude`
+        when possible. Returns None if no recipe has the flag.
+        """
+        ids = self.ids_for(flag)
+        if not ids:
+            return None
+        # Exclusions are few compared to the catalogue, so a couple of redraws almost always do
+        for _ in range(8):
+            recipe_id = ids[random.randrange(len(ids))]
+            if recipe_id not in exclude:
+                return recipe_id
+        remaining = [recipe_id for recipe_id in ids if recipe_id not in exclude]
+        return random.choice(remaining or ids)
+
+
+catalogue = RecipeCatalogue()
+
+meal_model = BaseModel('Meals')
+# {meal_id: Recipes flag column}, rebuilt after writes to Meals
+_meal_flags = None
+
+
+def _build_meal_flags() -> dict:
+    """Match each meal type to its flag column ('Morning Snack' -> 'if_morning_snack'), checking the result."""
+    columns = [col for col in catalogue.model.columns if col in MEAL_FLAGS]
+    mapping = {}
+    for meal in meal_model.select_all() or []:
+        name = meal['name'].lower().strip()
+        exact = f"if_{name.replace(' ', '_')}"
+        matches = [exact] if exact in columns else [col for col in columns if name in col.replace('_', ' ')]
+        if len(matches) != 1:
+            print(f"Warning: meal type '{meal['name']}' matches {len(matches)} Recipes flag columns {matches}.")
+            continue
+        mapping[meal['id']] = matches[0]
+    if len(set(mapping.values())) != len(mapping):
+        print(f"Warning: several meal types share a Recipes flag column: {mapping}")
+    return mapping
+
+
+def meal_flag_columns() -> dict:
+    """{meal_id: Recipes flag column}, built once (no queries afterwards until Meals changes)."""
+    global _meal_flags
+    if _meal_flags is None:
+        mapping = _build_meal_flags()
+        # Don't keep an empty mapping from an unreachable database
+        if not mapping:
+            return mapping
+        _meal_flags = mapping
+    return _meal_flags
+
+
+def flag_for_meal(meal_id):
+    """The Recipes flag column of a meal type (e.g. 'if_lunch'), or None if unknown."""
+    return meal_flag_columns().get(meal_id)
+
+
+def _forget_meal_flags(table_name=None) -> None:
+    global _meal_flags
+    _meal_flags = None
+
+
+cache.on_invalidate('Meals', _forget_meal_flags)
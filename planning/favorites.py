@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from database.db_connector import after_commit
+from database.models import BaseModel
+from .alias import AliasTable
+from .catalogue import MEAL_FLAGS, catalogue, rating_weight
+
+# Per-user favorite tables kept in memory, and how long before they are reloaded anyway
+FAVORITES_CACHE_SIZE = int(os.getenv('FAVORITES_CACHE_SIZE', 1024))
+FAVORITES_MAX_AGE = float(os.getenv('FAVORITES_MAX_AGE', 600))
+
+favorites_recipes_model = BaseModel('User_favorite_recipes')
+
+_lock = threading.Lock()
+# {user_id: (loaded_at, favorite recipe ids, {flag: AliasTable})}
+_tables = OrderedDict()
+# Bumped whenever entries are dropped, so a build that raced with it isn't stored
+_epoch = 0
+
+
+def _build(user_id) -> tuple:
+    rows = favorites_recipes_model.run_query(
+        "SELECT recipe_id FROM User_favorite_recipes WHERE user_id = %s", (user_id,), prepared=True)
+    favorite_ids = frozenset(row['recipe_id'] for row in rows or [])
+    tables = {}
+    for flag in MEAL_FLAGS:
+        ids = [recipe_id for recipe_id in favorite_ids if catalogue.has(flag, recipe_id)]
+        if ids:
+            tables[flag] = AliasTable(ids, [rating_weight(catalogue.rating(i)) for i in ids])
+    return favorite_ids, tables
+
+
+def favorite_tables(user_id) -> dict:
+    """
+    {flag: AliasTable} over the user's favorite recipes, weighted by rating.
+    Built from one small query and kept until the user's favorites change, or until
+    one of the favorite recipes changes in the catalogue.
+    """
+    # A pending catalogue reload first drops the tables it makes stale
+    catalogue.refresh()
+    with _lock:
+        entry = _tables.get(user_id)
+        if entry and time.monotonic() - entry[0] < FAVORITES_MAX_AGE:
+            _tables.move_to_end(user_id)
+            return entry[2]
+        epoch = _epoch
+    loaded_at = time.monotonic()
+    favorite_ids, tables = _build(user_id)
+    with _lock:
+        if epoch == _epoch:
+            _tables[user_id] = (loaded_at, favorite_ids, tables)
+            while len(_tables) > FAVORITES_CACHE_SIZE:
+                _tables.popitem(last=False)
+    return tables
+
+
+def forget(user_id) -> None:
+    """Rebuild the user's tables on next use. Call after changing their favorites."""
+    def drop():
+        global _epoch
+        with _lock:
+            _tables.pop(user_id, None)
+            _epoch += 1
+    drop()
+    # A reload before the commit would still see the old favorites
+    after_commit(drop)
+
+
+def _forget_changed(recipe_ids) -> None:
+    """Drop the tables holding any of these recipes (all tables if None)."""
+    global _epoch
+    with _lock:
+        stale = [user_id for user_id, entry in _tables.items()
+                 if recipe_ids is None or not entry[1].isdisjoint(recipe_ids)]
+        for user_id in stale:
+            del _tables[user_id]
+        _epoch += 1
+
+
+# Tables hold recipe flags and ratings, so those of users whose favorites changed go stale
+catalogue.on_change(_forget_changed)
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from database import cache
+from database.models import BaseModel
+
+# Writes in other processes aren't seen by the invalidation hook, so reload after this long anyway
+MATRIX_MAX_AGE = float(os.getenv('INGREDIENT_MATRIX_MAX_AGE', 300))
+
+
+class _Matrix:
+    """
+    One load: a packed recipe x ingredient bitset (one row of uint64 words per
+    recipe) plus the inverted index, i.e. for each ingredient the rows of the
+    recipes using it (`postings[offsets[c]:offsets[c + 1]]`).
+    """
+
+    def __init__(self, recipe_ids, ingredient_ids, bits, postings, offsets, sizes):
+        self.recipe_ids = recipe_ids
+        self.ingredient_ids = ingredient_ids
+        self.bits = bits
+        self.postings = postings
+        self.offsets = offsets
+        self.sizes = sizes
+        self.rows = {int(recipe_id): row for row, recipe_id in enumerate(recipe_ids)}
+        self.columns = {int(ingredient_id): column for column, ingredient_id in enumerate(ingredient_ids)}
+
+
+class IngredientMatrix:
+    """
+    Process-wide recipe x ingredient incidence matrix from Recipes_ingredients, stored
+    as packed bits so set operations over many recipes are a few vectorized word ops.
+    Loaded on first use and reloaded after writes to Recipes_ingredients.
+    """
+
+    def __init__(self, model=None):
+        self.model = model or BaseModel('Recipes_ingredients')
+        self._lock = threading.Lock()
+        self._data = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        cache.on_invalidate('Recipes_ingredients', self.invalidate)
+
+    def invalidate(self, table_name=None) -> None:
+        """Reload on next use."""
+        self._generation += 1
+        self._data = None
+
+    def _load(self) -> _Matrix:
+        rows = self.model.run_query("SELECT DISTINCT recipe_id, ingredient_id FROM Recipes_ingredients") or []
+        pairs = np.array([(row['recipe_id'], row['ingredient_id']) for row in rows], dtype=np.int64).reshape(-1, 2)
+        recipe_ids, row_index = np.unique(pairs[:, 0], return_inverse=True)
+        ingredient_ids, column_index = np.unique(pairs[:, 1], return_inverse=True)
+        words = max(1, (len(ingredient_ids) + 63) // 64)
+        # The extra last row stays empty: it stands in for recipes without ingredients
+        bits = np.zeros((len(recipe_ids) + 1, words), dtype=np.uint64)
+        np.bitwise_or.at(bits, (row_index, column_index // 64),
+                         np.left_shift(np.uint64(1), (column_index % 64).astype(np.uint64)))
+        order = np.argsort(column_index, kind='stable')
+        postings = row_index[order]
+        offsets = np.searchsorted(column_index[order], np.arange(len(ingredient_ids) + 1))
+        sizes = np.bincount(row_index, minlength=len(recipe_ids))
+        return _Matrix(recipe_ids, ingredient_ids, bits, postings, offsets, sizes)
+
+    def _matrix(self) -> _Matrix:
+        data = self._data
+        if data is None or time.monotonic() - self._loaded_at > MATRIX_MAX_AGE:
+            with self._lock:
+                data = self._data
+                if data is None or time.monotonic() - self._loaded_at > MATRIX_MAX_AGE:
+                    generation = self._generation
+                    data = self._load()
+                    # A write during the load may be missing from it: use it once, reload next time
+                    self._data = data if generation == self._generation else None
+                    self._loaded_at = time.monotonic()
+        return data
+
+    def rows(self, recipe_ids) -> np.ndarray:
+        """Bit rows of the given recipes (k x words); unknown recipes get empty rows."""
+        data = self._matrix()
+        empty = len(data.bits) - 1
+        index = np.fromiter((data.rows.get(recipe_id, empty) for recipe_id in recipe_ids), dtype=np.intp)
+        return data.bits[index]
+
+    def union(self, recipe_ids) -> np.ndarray:
+        """Bitset of every ingredient used by any of the recipes."""
+        rows = self.rows(recipe_ids)
+        return np.bitwise_or.reduce(rows, axis=0) if len(rows) else np.zeros(self.words, dtype=np.uint64)
+
+    @property
+    def words(self) -> int:
+        return self._matrix().bits.shape[1]
+
+    @staticmethod
+    def count(bits) -> np.ndarray:
+        """Number of ingredients in each bitset row (or in a single bitset)."""
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+
+    def new_ingredients(self, recipe_ids, base) -> np.ndarray:
+        """For each recipe, how many of its ingredients are not in the `base` bitset."""
+        return self.count(self.rows(recipe_ids) & ~base)
+
+    def coverage(self, ingredient_ids, recipe_ids=None) -> tuple:
+        """
+        How much of each recipe the given ingredients cover, from the inverted index:
+        only the postings of those ingredients are touched.
+        Args:
+            ingredient_ids (iterable): The ingredients at hand.
+            recipe_ids (iterable, optional): Only score these recipes (e.g. one meal type).
+        Returns: (recipe ids, covered ingredient counts, recipe ingredient counts) as arrays,
+        for the recipes sharing at least one ingredient."""
+        data = self._matrix()
+        columns = [data.columns[i] for i in set(ingredient_ids) if i in data.columns]
+        if not columns:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        rows = np.concatenate([data.postings[data.offsets[c]:data.offsets[c + 1]] for c in columns])
+        have = np.bincount(rows, minlength=len(data.recipe_ids))
+        if recipe_ids is not None:
+            wanted = np.fromiter(recipe_ids, dtype=np.int64)
+            position = np.searchsorted(data.recipe_ids, wanted)
+            known = position < len(data.recipe_ids)
+            known[known] = data.recipe_ids[position[known]] == wanted[known]
+            mask = np.zeros(len(data.recipe_ids), dtype=bool)
+            mask[position[known]] = True
+            have = np.where(mask, have, 0)
+        matched = np.flatnonzero(have)
+        return data.recipe_ids[matched], have[matched], data.sizes[matched]
+
+
+matrix = IngredientMatrix()
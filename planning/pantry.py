@@ -0,0 +1,53 @@
+import random
+
+import numpy as np
+
+from database.models import BaseModel
+from .catalogue import catalogue
+from .ingredients import matrix
+
+ing_model = BaseModel('Ingredients')
+
+
+def ingredient_ids_by_name(names) -> list:
+    """Ids of the ingredients with these names (case-insensitive), in one query."""
+    names = list({name.strip().lower() for name in names if name and name.strip()})
+    if not names:
+        return []
+    placeholders = ', '.join(['%s'] * len(names))
+    rows = ing_model.run_query(f"SELECT id FROM Ingredients WHERE LOWER(name) IN ({placeholders})", tuple(names))
+    return [row['id'] for row in rows or []]
+
+
+def rank_by_pantry(ingredient_ids, flag=None, limit=50, min_coverage=0.0) -> list:
+    """
+    Rank recipes by the share of their ingredients found in the pantry.
+    Args:
+        ingredient_ids (iterable): Ingredients the user has.
+        flag (str, optional): Only recipes of this meal type (e.g. 'if_dinner').
+        limit (int, optional): Best recipes to return. Defaults to 50.
+        min_coverage (float, optional): Leave out recipes covered less than this (0..1).
+    Returns: [{'recipe_id', 'coverage', 'have', 'total'}], best coverage first
+    (ties go to the recipe using more of the pantry)."""
+    recipe_ids, have, total = matrix.coverage(ingredient_ids, catalogue.ids_for(flag) if flag else None)
+    coverage = have / np.maximum(total, 1)
+    keep = np.flatnonzero(coverage >= min_coverage)
+    if len(keep) > limit:
+        # Partition on a combined key before sorting only the winners
+        key = coverage[keep] + have[keep] * 1e-6
+        keep = keep[np.argpartition(-key, limit)[:limit]]
+    order = keep[np.lexsort((-have[keep], -coverage[keep]))]
+    return [{'recipe_id': int(recipe_ids[i]), 'coverage': float(coverage[i]),
+             'have': int(have[i]), 'total': int(total[i])} for i in order]
+
+
+def pantry_pick(ingredient_ids, flag, exclude=(), top=20):
+    """
+    Random recipe id for a meal type, weighted by pantry coverage among the `top`
+    best covered ones. None if no recipe of the type uses anything in the pantry.
+    """
+    ranked = [r for r in rank_by_pantry(ingredient_ids, flag, limit=top + len(exclude))
+              if r['recipe_id'] not in exclude][:top]
+    if not ranked:
+        return None
+    return random.choices([r['recipe_id'] for r in ranked], weights=[r['coverage'] for r in ranked])[0]
@@ -0,0 +1,181 @@
+import os
+import random
+import time
+
+import numpy as np
+
+from .catalogue import catalogue
+from .favorites import favorite_tables
+from .ingredients import matrix
+from .sampler import FAVORITE_SHARE, recent_recipes
+
+# Prep plus cooking minutes the plan should stay within per day. A day whose slots can't fit
+# even with the quickest eligible recipes gets that minimum as its budget instead.
+DAILY_MINUTES = float(os.getenv('PLANNER_DAILY_MINUTES', 240))
+# A recipe shouldn't come back within this many days (inside the plan or after a recent menu)
+NO_REPEAT_DAYS = int(os.getenv('PLANNER_NO_REPEAT_DAYS', 7))
+# Recipes of one category allowed per day before it counts against variety
+MAX_PER_CATEGORY = int(os.getenv('PLANNER_MAX_PER_CATEGORY', 1))
+# Improvement phase budget; the greedy plan built first is returned if it runs out
+TIME_LIMIT_MS = float(os.getenv('PLANNER_TIME_LIMIT_MS', 30))
+
+# Overlap mode: candidate recipes scored per slot in one vectorized pass
+OVERLAP_CANDIDATES = int(os.getenv('PLANNER_OVERLAP_CANDIDATES', 256))
+
+# Penalties: a repeat outweighs any amount of category overlap or overtime
+REPEAT_COST = 1000.0
+CATEGORY_COST = 50.0
+OVERTIME_COST_PER_MINUTE = 1.0
+# Overlap mode: each ingredient a recipe adds to the plan's shopping list
+INGREDIENT_COST = float(os.getenv('PLANNER_INGREDIENT_COST', 5))
+
+
+class WeeklyPlanner:
+    """
+    Builds a multi-day plan in one solve on the in-memory recipe catalogue.
+    Hard-ish constraints are expressed as penalties so a plan is always returned:
+    meal-type eligibility (only eligible recipes are ever proposed), no repeats
+    within `no_repeat_days`, at most `max_per_category` recipes of a category
+    per day and a daily prep+cooking `daily_minutes` budget. The budget of a day
+    is raised to what its quickest eligible recipes take, so overtime that no
+    plan can avoid (e.g. six slots of recipes without times, 60 minutes each by
+    default) doesn't keep the local search busy until the time limit.
+
+    A greedy pass fills the slots first (the fallback), then a local search
+    re-draws the slots that carry penalties until none are left or the time
+    limit runs out.
+
+    In overlap mode every ingredient a recipe adds to the plan is penalized too,
+    so recipes sharing ingredients win and the merged shopping list gets shorter.
+    Each slot then scores OVERLAP_CANDIDATES recipes at once against the plan's
+    ingredient bitset (see planning.ingredients) and only the best few are
+    checked against the other constraints.
+    """
+
+    def __init__(self, daily_minutes=DAILY_MINUTES, no_repeat_days=NO_REPEAT_DAYS,
+                 max_per_category=MAX_PER_CATEGORY, time_limit_ms=TIME_LIMIT_MS, candidates=24,
+                 overlap_candidates=OVERLAP_CANDIDATES, ingredient_cost=INGREDIENT_COST):
+        self.daily_minutes = daily_minutes
+        self.no_repeat_days = no_repeat_days
+        self.max_per_category = max_per_category
+        self.time_limit_ms = time_limit_ms
+        self.candidates = candidates
+        self.overlap_candidates = overlap_candidates
+        self.ingredient_cost = ingredient_cost
+
+    def _propose(self, flag, favorites, weighted, count):
+        """Candidate recipe ids for a slot: the whole pool if small, else a (weighted) sample."""
+        ids = catalogue.ids_for(flag)
+        if len(ids) <= count:
+            return list(ids)
+        if not weighted:
+            return [ids[random.randrange(len(ids))] for _ in range(count)]
+        table, favorite_table = catalogue.rating_table(flag), favorites.get(flag)
+        return [favorite_table.draw() if favorite_table is not None and random.random() < FAVORITE_SHARE
+                else table.draw() for _ in range(count)]
+
+    def _budgets(self, days) -> list:
+        """Prep+cooking minutes allowed per day: daily_minutes, or the least the day's slots can take."""
+        return [max(self.daily_minutes, sum(catalogue.quickest(flag) for flag in flags)) for flags in days]
+
+    def _slot_cost(self, plan, day, slot, recipe_id, blocked, budgets) -> float:
+        """Penalties that involve `recipe_id` if it were placed in plan[day][slot]."""
+        if recipe_id is None:
+            return 0.0
+        cost = REPEAT_COST if recipe_id in blocked else 0.0
+
+        # Repeats, costlier the closer together they are
+        first, last = max(0, day - self.no_repeat_days + 1), min(len(plan), day + self.no_repeat_days)
+        for other_day in range(first, last):
+            for other_slot, other_id in enumerate(plan[other_day]):
+                if other_id == recipe_id and (other_day, other_slot) != (day, slot):
+                    cost += REPEAT_COST * (self.no_repeat_days - abs(other_day - day)) / self.no_repeat_days
+
+        category = catalogue.category(recipe_id)
+        minutes = catalogue.minutes(recipe_id)
+        same_category = 0
+        for other_slot, other_id in enumerate(plan[day]):
+            if other_slot == slot or other_id is None:
+                continue
+            minutes += catalogue.minutes(other_id)
+            if category is not None and catalogue.category(other_id) == category:
+                same_category += 1
+        if same_category >= self.max_per_category:
+            cost += CATEGORY_COST
+        return cost + max(0.0, minutes - budgets[day]) * OVERTIME_COST_PER_MINUTE
+
+    def _place(self, plan, day, slot, flag, favorites, weighted, blocked, budgets, overlap) -> bool:
+        """Put the cheapest of a fresh batch of candidates (or the current recipe) in the slot."""
+        current = plan[day][slot]
+        if not overlap:
+            candidates = self._propose(flag, favorites, weighted, self.candidates)
+            extra = [0.0] * len(candidates)
+        else:
+            candidates = list(dict.fromkeys(self._propose(flag, favorites, weighted, self.overlap_candidates)))
+            others = [recipe_id for d, recipes in enumerate(plan) for s, recipe_id in enumerate(recipes)
+                      if recipe_id is not None and (d, s) != (day, slot)]
+            base = matrix.union(others)
+            added = matrix.new_ingredients(candidates + ([current] if current else []), base)
+            if current:
+                current_extra, added = added[-1] * self.ingredient_cost, added[:-1]
+            # Only the candidates adding the fewest ingredients go on to the full check
+            if len(candidates) > self.candidates:
+                keep = np.argpartition(added, self.candidates)[:self.candidates]
+                candidates, added = [candidates[i] for i in keep], added[keep]
+            extra = (added * self.ingredient_cost).tolist()
+
+        best, best_cost = current, None
+        if current:
+            best_cost = self._slot_cost(plan, day, slot, current, blocked, budgets) + (current_extra if overlap else 0.0)
+        for recipe_id, recipe_extra in zip(candidates, extra):
+            cost = self._slot_cost(plan, day, slot, recipe_id, blocked, budgets) + recipe_extra
+            if best_cost is None or cost < best_cost:
+                best, best_cost = recipe_id, cost
+        plan[day][slot] = best
+        return best != current
+
+    def solve(self, days, user_id=None, recent=None, exclude=(), weighted=False, overlap=False) -> list:
+        """
+        Plan every meal slot of a (multi-day) plan.
+        Args:
+            days (list): One list of meal-type flags per day, e.g. [['if_breakfast', 'if_lunch'], ...].
+            user_id (int, optional): Avoid this user's recent recipes (one query) and, when
+                weighted, favor their favorites.
+            recent (set or dict, optional): Recipe ids planned lately, instead of querying them for `user_id`.
+            exclude (set, optional): Recipe ids to avoid like repeats.
+            weighted (bool, optional): Propose candidates by rating and favorites instead of uniformly.
+            overlap (bool, optional): Prefer recipes that share ingredients with the rest of the plan.
+        Returns: Recipe ids shaped like `days`; None where a meal type has no recipes at all.
+        """
+        deadline = time.perf_counter() + self.time_limit_ms / 1000
+        if recent is None:
+            recent = recent_recipes(user_id) if user_id else {}
+        if isinstance(recent, dict):
+            recent = {recipe_id for recipe_id, age in recent.items() if age < self.no_repeat_days}
+        blocked = set(recent) | set(exclude)
+        favorites = favorite_tables(user_id) if weighted and user_id else {}
+        plan = [[None] * len(flags) for flags in days]
+        budgets = self._budgets(days)
+
+        # Greedy: meal types with the fewest recipes first, while their choices are still open
+        slots = sorted((len(catalogue.ids_for(flag)), day, slot, flag)
+                       for day, flags in enumerate(days) for slot, flag in enumerate(flags))
+        slots = [(day, slot, flag) for _, day, slot, flag in slots if catalogue.ids_for(flag)]
+        for day, slot, flag in slots:
+            self._place(plan, day, slot, flag, favorites, weighted, blocked, budgets, overlap)
+
+        # Local search: re-draw penalized slots until the plan is clean, stops improving or time is up.
+        # In overlap mode any slot may still cut ingredients, so clean slots are re-drawn too.
+        stale = 0
+        while time.perf_counter() < deadline and stale < 2 * len(slots):
+            penalized = [(day, slot, flag) for day, slot, flag in slots
+                         if self._slot_cost(plan, day, slot, plan[day][slot], blocked, budgets) > 0]
+            if not penalized and not overlap:
+                break
+            day, slot, flag = random.choice(penalized or slots)
+            changed = self._place(plan, day, slot, flag, favorites, weighted, blocked, budgets, overlap)
+            stale = 0 if changed else stale + 1
+        return plan
+
+
+planner = WeeklyPlanner()
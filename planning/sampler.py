@@ -0,0 +1,112 @@
+import os
+import random
+
+from database.models import BaseModel
+from .catalogue import catalogue
+from .favorites import favorite_tables
+
+# Recipes used in the user's menus from this many days back (and any later ones) are avoided
+RECENT_MENU_DAYS = int(os.getenv('RECENT_MENU_DAYS', 7))
+# Weighted mode: share of draws taken from the user's favorites (when they have some for the meal type)
+FAVORITE_SHARE = float(os.getenv('FAVORITE_SHARE', 0.3))
+# Weighted mode: a recipe served this many days ago is half as likely to be accepted again
+RECENCY_HALF_LIFE_DAYS = float(os.getenv('RECENCY_HALF_LIFE_DAYS', 2))
+
+menu_meals_model = BaseModel('Menu_meals')
+
+
+def recent_recipes(user_id, days=RECENT_MENU_DAYS) -> dict:
+    """
+    Recipes in the user's menus dated from `days` ago onwards, in one query.
+    Returns {recipe_id: days since it was last planned (0 for today and later)}.
+    """
+    rows = menu_meals_model.run_query("""
+        SELECT mm.recipe_id, DATEDIFF(CURDATE(), MAX(m.menu_date)) as days_ago
+        FROM Menu_meals mm
+        JOIN Menus m ON mm.menu_id = m.id
+        WHERE m.user_id = %s AND m.menu_date >= CURDATE() - INTERVAL %s DAY
+        GROUP BY mm.recipe_id
+    """, (user_id, days), prepared=True)
+    return {row['recipe_id']: max(int(row['days_ago']), 0) for row in rows or []}
+
+
+def _draw(ids, avoid):
+    """
+    Random id from `ids` that is in none of the `avoid` sets. If there is none,
+    the sets are relaxed from the last one backwards.
+    """
+    for keep in range(len(avoid), -1, -1):
+        sets = avoid[:keep]
+        # Rejection sampling is O(1) while most ids are still free...
+        for _ in range(8):
+            recipe_id = ids[random.randrange(len(ids))]
+            if not any(recipe_id in used for used in sets):
+                return recipe_id
+        # ...and a scan settles it when few are left
+        remaining = [recipe_id for recipe_id in ids if not any(recipe_id in used for used in sets)]
+        if remaining:
+            return random.choice(remaining)
+    return None
+
+
+def _weighted_draw(flag, favorites, avoid, ages):
+    """
+    Draw from a mixture of the catalogue's rating table and the user's favorites
+    table, then accept with a probability that recovers as the recipe's last use
+    ages. Returns None if nothing was accepted within a few tries.
+    """
+    table = catalogue.rating_table(flag)
+    favorite_table = favorites.get(flag)
+    for _ in range(16):
+        if favorite_table is not None and random.random() < FAVORITE_SHARE:
+            recipe_id = favorite_table.draw()
+        else:
+            recipe_id = table.draw()
+        if any(recipe_id in used for used in avoid):
+            continue
+        age = ages.get(recipe_id)
+        if age is None or random.random() < 1 - 0.5 ** ((age + 1) / RECENCY_HALF_LIFE_DAYS):
+            return recipe_id
+    return None
+
+
+def sample_plan(days, user_id=None, recent=None, exclude=(), weighted=False) -> list:
+    """
+    Draw a recipe id for every meal slot of a (multi-day) plan in one pass.
+    Recipes are distinct within each day, distinct across the plan while the
+    catalogue allows, and avoid the user's recent menus while possible.
+    Args:
+        days (list): One list of meal-type flags per day, e.g. [['if_breakfast', 'if_lunch'], ...].
+        user_id (int, optional): Avoid recipes from this user's recent menus (one query).
+        recent (set or dict, optional): Recipe ids to avoid, instead of querying them for `user_id`.
+            A dict of {recipe_id: days ago} (see recent_recipes) feeds the recency decay.
+        exclude (set, optional): Recipe ids to avoid whenever the meal type has others
+            (e.g. the ones being replaced), in weighted mode too.
+        weighted (bool, optional): Favor higher ratings and the user's favorites, and let
+            recent recipes back in gradually instead of avoiding them outright.
+    Returns: Recipe ids shaped like `days`; None where a meal type has no recipes at all.
+    """
+    if recent is None:
+        recent = recent_recipes(user_id) if user_id else {}
+    ages = recent if isinstance(recent, dict) else dict.fromkeys(recent, 0)
+    favorites = favorite_tables(user_id) if weighted and user_id else {}
+    plan = [[None] * len(flags) for flags in days]
+    plan_used = set()
+    day_used = [set() for _ in days]
+
+    # Meal types with the fewest recipes go first, while their choices are still open
+    slots = [(len(catalogue.ids_for(flag)), day, slot, flag)
+             for day, flags in enumerate(days) for slot, flag in enumerate(flags)]
+    for _, day, slot, flag in sorted(slots):
+        ids = catalogue.ids_for(flag)
+        if not ids:
+            continue
+        recipe_id = None
+        if weighted:
+            recipe_id = _weighted_draw(flag, favorites, (day_used[day], plan_used, exclude), ages)
+        if recipe_id is None:
+            recipe_id = _draw(ids, (day_used[day], plan_used, exclude, recent))
+        plan[day][slot] = recipe_id
+        plan_used.add(recipe_id)
+        day_used[day].add(recipe_id)
+    return plan
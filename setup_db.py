@@ -1,7 +1,7 @@
 import os
 from app import menu
 from database.db_connector import create_connection
-from database.models import BaseModel
+from database.models import BaseModel, load_table_columns
 import pandas as pd
 
 def run_schema( path='database', schema_file_name='schema.sql'):
@@ -31,6 +31,8 @@ def run_schema( path='database', schema_file_name='schema.sql'):
         
         db.commit()
         print("\n✅ Success: All tables created successfully!")
+        # The tables were just (re)created, so drop any column names cached before
+        load_table_columns(refresh=True)
 
     except Exception as e:
         print(f"\n❌ Error: {e}")
@@ -47,13 +49,10 @@ def populate_meals(meals_model: BaseModel):
         meals_model: The MealsModel instance.
     '''
     print('Populating Meals table...')
-    for meal in meals_dict:
-        if list(meal.keys()) == meals_model.columns[1:]:
-            try:
-                meals_model.insert(meal)
-                print(f"Inserted meal: {meal['name']}")
-            except Exception as e:
-                print(f"Error inserting meal {meal['name']}: {e}")
+    new_ids = meals_model.insert_many(meals_dict)
+    if new_ids:
+        for meal in meals_dict:
+            print(f"Inserted meal: {meal['name']}")
     print('-'*10)
     print('meals insertion attempt finished')
 
@@ -174,8 +173,10 @@ if __name__ == "__main__":
     ing_cat_map_model = BaseModel('Ingredients_categories_map')
     ingredients_data = ingredients_model.select_all()
     if ingredients_data is not None and isinstance(ingredients_data, list):
-        for ingredient in ingredients_data:
-            ing_cat_map_model.insert({'ingredient_id': ingredient['id'], 'category_id': others_id, 'source_id': menu_generator_id})
+        ing_cat_map_model.insert_many([
+            {'ingredient_id': ingredient['id'], 'category_id': others_id, 'user_id': None, 'source_id': menu_generator_id}
+            for ingredient in ingredients_data
+        ])
     
     #units
     units_model.populate_from_csv(os.path.join('data', 'units.csv'), 'Units', delimiter=',')
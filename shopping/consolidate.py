@@ -0,0 +1,102 @@
+from operator import itemgetter
+
+import numpy as np
+
+from .units import ingredient_densities, unit_metadata
+
+# Unit kinds, by how their amounts combine
+_MASS, _VOLUME, _COUNT, _SUBJECTIVE = 0, 1, 2, 3
+_KINDS = {'Mass': _MASS, 'Volume': _VOLUME, 'Count': _COUNT}
+
+
+def consolidate_rows(rows, units=None, densities=None) -> list:
+    """
+    Vectorized consolidation of shopping rows, for long (merged) lists. Gives the same
+    list as app.consolidate_by_ingredient: per ingredient, in first-seen order, one
+    g/kg line for all mass and volume amounts (volume converted with the ingredient's
+    density), then one line per count unit; subjective units become "As required".
+    Args:
+        rows (list): Dicts with ingredient_id, measure, units and category_id.
+        units (dict, optional): Unit metadata; defaults to the cached Units table.
+        densities (dict, optional): {ingredient_id: g/ml}; defaults to the cached Ingredients densities.
+    """
+    if not rows:
+        return []
+    units = unit_metadata() if units is None else units
+    densities = ingredient_densities() if densities is None else densities
+
+    # Pull the columns out with C-level iteration; everything after is array work
+    unit_index = {}
+    unit_names, unit_kinds, unit_factors = [], [], []
+    for name in set(map(itemgetter('units'), rows)):
+        key = name.lower().strip()
+        info = units.get(key)
+        unit_index[name] = len(unit_names)
+        unit_names.append(key)
+        # Unknown units are kept as counts so nothing is lost
+        unit_kinds.append(_KINDS.get(info['category'], _SUBJECTIVE) if info else _COUNT)
+        unit_factors.append(float(info['factor']) if info else 1.0)
+    n = len(rows)
+    ingredient = np.fromiter(map(itemgetter('ingredient_id'), rows), dtype=np.int64, count=n)
+    measure = np.fromiter(map(float, map(itemgetter('measure'), rows)), dtype=np.float64, count=n)
+    unit = np.fromiter(map(unit_index.__getitem__, map(itemgetter('units'), rows)), dtype=np.int64, count=n)
+
+    # Distinct ingredients in first-seen order, with the category of their first row
+    ingredient_ids, first_row, ingredient_pos = np.unique(ingredient, return_index=True, return_inverse=True)
+    kinds = np.asarray(unit_kinds)[unit]
+    density = np.array([densities.get(int(i), 1.0) for i in ingredient_ids])
+
+    # Mass and volume: grams per ingredient, volume scaled by density
+    grams = measure * np.asarray(unit_factors)[unit]
+    grams = np.where(kinds == _VOLUME, grams * density[ingredient_pos], grams)
+    grams = np.where(kinds <= _VOLUME, grams, 0.0)
+    total_grams = np.bincount(ingredient_pos, weights=grams, minlength=len(ingredient_ids))
+
+    # Counts and subjective units: one line per (ingredient, unit name)
+    names = np.unique(np.asarray(unit_names), return_inverse=True)
+    name_of_unit = names[1]
+    counted = np.flatnonzero(kinds >= _COUNT)
+    pair = ingredient_pos[counted] * len(names[0]) + name_of_unit[unit[counted]]
+    pairs, pair_first, pair_pos = np.unique(pair, return_index=True, return_inverse=True)
+    quantities = np.bincount(pair_pos, weights=measure[counted], minlength=len(pairs))
+    subjective = np.zeros(len(pairs), dtype=bool)
+    np.logical_or.at(subjective, pair_pos, kinds[counted] == _SUBJECTIVE)
+
+    # Order like the dict loop: by ingredient first seen, grams line first, then units first seen
+    n_names = len(names[0])
+    with_grams = np.flatnonzero(total_grams > 0)
+    pair_ingredient = pairs // n_names
+    first_seen = np.concatenate([first_row[with_grams], first_row[pair_ingredient]])
+    then_seen = np.concatenate([np.full(len(with_grams), -1), counted[pair_first]])
+    order = np.lexsort((then_seen, first_seen)).tolist()
+
+    # Plain Python values for the output loop (numpy scalars are slow to handle one by one)
+    n_grams = len(with_grams)
+    line_ingredient = np.concatenate([with_grams, pair_ingredient]).tolist()
+    ids = ingredient_ids.tolist()
+    categories = [rows[first]['category_id'] for first in first_row.tolist()]
+    totals = total_grams.tolist()
+    quantities = quantities.tolist()
+    subjective = subjective.tolist()
+    unit_of_pair = names[0][pairs % n_names].tolist()
+
+    final_shopping_list = []
+    for line in order:
+        pos = line_ingredient[line]
+        if line < n_grams:
+            total = totals[pos]
+            if total >= 1000:
+                final_shopping_list.append({'ingredient_id': ids[pos], 'measure': round(total / 1000, 2),
+                                            'units': 'kg', 'category_id': categories[pos]})
+            else:
+                final_shopping_list.append({'ingredient_id': ids[pos], 'measure': round(total, 1),
+                                            'units': 'g', 'category_id': categories[pos]})
+        else:
+            k = line - n_grams
+            final_shopping_list.append({
+                'ingredient_id': ids[pos],
+                'measure': "As required" if subjective[k] else quantities[k],
+                'units': unit_of_pair[k],
+                'category_id': categories[pos],
+            })
+    return final_shopping_list
@@ -0,0 +1,262 @@
+from collections import defaultdict
+
+from mysql.connector import Error
+
+from database.models import BaseModel
+
+ing_model = BaseModel('Ingredients')
+list_model = BaseModel('Shopping_list')
+items_model = BaseModel('Shopping_list_ingredients')
+
+# Item columns a collaborator may change through change_item()
+ITEM_FIELDS = ('measure', 'units', 'price', 'if_checked', 'category_id')
+
+_UPDATE_SQL = """
+    UPDATE Shopping_list_ingredients
+    SET measure = %s, units = %s, price = %s, if_checked = %s, category_id = %s
+    WHERE id = %s"""
+
+# Items as the list page shows them, plus their id
+_ITEMS_SQL = """
+    SELECT
+        sli.id,
+        COALESCE(i.name, sli.item_name) as name,
+        sli.measure, sli.units, sli.price, sli.if_checked,
+        ic.name as category,
+        sli.category_id
+    FROM Shopping_list_ingredients sli
+    LEFT JOIN Ingredients i ON sli.ingredient_id = i.id
+    LEFT JOIN Ingredient_categories ic ON sli.category_id = ic.id
+    WHERE sli.shop_list_id = %s AND sli.id IN ({ids})"""
+
+
+class VersionConflict(Exception):
+    """The list was changed by someone else since the client read `version`."""
+
+    def __init__(self, version):
+        super().__init__(f"Shopping list is at version {version}")
+        self.version = version
+
+
+def ingredient_ids_for(names) -> dict:
+    """{lower-cased name: ingredient id} for the names that are known ingredients, in one query."""
+    names = list({name.strip().lower() for name in names if name and name.strip()})
+    if not names:
+        return {}
+    placeholders = ', '.join(['%s'] * len(names))
+    rows = ing_model.run_query(
+        f"SELECT LOWER(name) AS name, MIN(id) AS id FROM Ingredients WHERE LOWER(name) IN ({placeholders}) GROUP BY LOWER(name)",
+        tuple(names)
+    )
+    return {row['name']: row['id'] for row in rows or []}
+
+
+def write_items(shop_list_id, items) -> list:
+    """
+    Insert shopping list items with multi-row INSERTs in one transaction, instead of one
+    statement (and commit) per item.
+    Args:
+        shop_list_id (int): The Shopping_list the items belong to.
+        items (list): Dicts of Shopping_list_ingredients columns (without shop_list_id),
+            all with the same keys.
+    Returns: The new item IDs. Raises Error on failure, so an enclosing transaction rolls back."""
+    rows = [{'shop_list_id': shop_list_id, **item} for item in items]
+    ids = items_model.insert_many(rows)
+    if ids is None:
+        raise Error(f"Could not write the items of shopping list {shop_list_id}.")
+    return ids
+
+
+def _identity(item) -> tuple:
+    """What makes two rows the same list entry: the ingredient, or the custom item's name."""
+    return item['ingredient_id'], item['item_name']
+
+
+def _values(item) -> tuple:
+    """The stored values of a row, normalized so form strings and DB values compare equal."""
+    category = item['category_id']
+    return (
+        _identity(item),
+        item['units'],
+        round(float(item['measure'] or 0), 2),
+        round(float(item['price'] or 0), 2),
+        int(item['if_checked'] or 0),
+        None if category in (None, '', 'null') else int(category),
+    )
+
+
+def save_items(shop_list_id, items, version) -> dict:
+    """
+    Make a shopping list hold exactly `items`, writing only the rows that changed:
+    identical rows are left alone, a changed entry (same ingredient or custom name)
+    is updated in place, and the rest are inserted or deleted. Runs in one transaction,
+    and only if the list is still at `version` (like change_item()).
+    Args:
+        shop_list_id (int): The Shopping_list to save.
+        items (list): Dicts with ingredient_id, item_name, measure, units, price,
+            if_checked and category_id.
+        version (int): The list version the form was loaded with.
+    Returns: {'inserted', 'updated', 'deleted'} row counts.
+    Raises VersionConflict if someone changed the list since, LookupError for an unknown list."""
+    with items_model.transaction():
+        new_version = _claim_version(shop_list_id, version)
+        stored = items_model.run_query(
+            """SELECT id, ingredient_id, item_name, measure, units, price, if_checked, category_id
+               FROM Shopping_list_ingredients WHERE shop_list_id = %s FOR UPDATE""",
+            (shop_list_id,)
+        ) or []
+
+        # Pair off unchanged rows first, so duplicates are matched one to one
+        unchanged = defaultdict(list)
+        for row in stored:
+            unchanged[_values(row)].append(row)
+        changed = []
+        for item in items:
+            same = unchanged.get(_values(item))
+            if same:
+                same.pop()
+            else:
+                changed.append(item)
+
+        # Left-over stored rows of the same entry are updated, the others deleted
+        leftover = defaultdict(list)
+        for rows in unchanged.values():
+            for row in rows:
+                leftover[_identity(row)].append(row)
+        updates, inserts = [], []
+        for item in changed:
+            (ingredient_id, item_name), units, measure, price, checked, category = _values(item)
+            rows = leftover.get((ingredient_id, item_name))
+            if rows:
+                updates.append((measure, units, price, checked, category, rows.pop()['id']))
+            else:
+                inserts.append({'ingredient_id': ingredient_id, 'item_name': item_name, 'measure': measure,
+                                'units': units, 'price': price, 'if_checked': checked, 'category_id': category})
+        deletes = [row['id'] for rows in leftover.values() for row in rows]
+
+        if deletes:
+            placeholders = ', '.join(['%s'] * len(deletes))
+            items_model.run_query(f"DELETE FROM Shopping_list_ingredients WHERE id IN ({placeholders})", tuple(deletes))
+        if updates:
+            items_model.run_many(_UPDATE_SQL, updates)
+        if inserts:
+            write_items(shop_list_id, inserts)
+        if deletes or updates or inserts:
+            # Collaborators holding the old version must reload before their next change
+            list_model.run_query("UPDATE Shopping_list SET version = %s WHERE id = %s", (new_version, shop_list_id))
+    return {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deletes)}
+
+
+def _checked(value) -> int:
+    """if_checked from a bool, 0/1 or 'true'/'false'/'0'/'1'; anything else raises ValueError."""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int) and value in (0, 1):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', '1', 'false', '0'):
+        return int(value.strip().lower() in ('true', '1'))
+    raise ValueError(f"if_checked must be true, false, 0 or 1, not {value!r}")
+
+
+def _field(name, value):
+    """One ITEM_FIELDS value from a client, converted to its column type."""
+    if name in ('measure', 'price'):
+        return round(float(value or 0), 2)
+    if name == 'if_checked':
+        return _checked(value)
+    if name == 'units':
+        return str(value or '').strip().lower()
+    return None if value in (None, '', 'null') else int(value)
+
+
+def _claim_version(shop_list_id, version) -> int:
+    """Lock the list row and return its next version; raise VersionConflict if `version` is stale."""
+    rows = list_model.run_query("SELECT version FROM Shopping_list WHERE id = %s FOR UPDATE", (shop_list_id,))
+    if not rows:
+        raise LookupError(f"Shopping list {shop_list_id} not found")
+    current = rows[0]['version']
+    if version is None or int(version) != current:
+        raise VersionConflict(current)
+    return current + 1
+
+
+def _stored_item(shop_list_id, item_id) -> dict:
+    rows = items_model.run_query(
+        "SELECT id, if_checked FROM Shopping_list_ingredients WHERE id = %s AND shop_list_id = %s FOR UPDATE",
+        (item_id, shop_list_id)
+    )
+    if not rows:
+        raise LookupError(f"Item {item_id} is not on shopping list {shop_list_id}")
+    return rows[0]
+
+
+def list_items(shop_list_id, item_ids) -> list:
+    """The given items of a list as shown on the list page, with measure and price as floats."""
+    item_ids = list(item_ids)
+    if not item_ids:
+        return []
+    query = _ITEMS_SQL.format(ids=', '.join(['%s'] * len(item_ids)))
+    rows = items_model.run_query(query, (shop_list_id, *item_ids)) or []
+    for row in rows:
+        for column in ('measure', 'price'):
+            if row[column] is not None:
+                row[column] = float(row[column])
+    return rows
+
+
+def change_item(shop_list_id, version, action, item_id=None, fields=None) -> dict:
+    """
+    Apply one collaborator's change to a single item, with optimistic concurrency:
+    the change only goes through if the list is still at `version`, and moves it on
+    by one. Writes touch only the changed row (plus the list's version).
+    Args:
+        shop_list_id (int): The Shopping_list.
+        version (int): The list version the client last saw.
+        action (str): 'toggle' (flip if_checked), 'update' (set ITEM_FIELDS),
+            'add' (new item; `fields` needs a 'name') or 'remove'.
+        item_id (int, optional): The item, for every action but 'add'.
+        fields (dict, optional): Column values for 'update' and 'add'.
+    Returns: {'version': new version, 'items': [changed rows], 'removed': [item ids]}.
+    Raises VersionConflict on a stale version, LookupError for an unknown list or item,
+    ValueError for an invalid action or field."""
+    fields = fields or {}
+    if action not in ('toggle', 'update', 'add', 'remove'):
+        raise ValueError(f"Unknown action: {action}")
+    unknown = set(fields) - set(ITEM_FIELDS) - ({'name'} if action == 'add' else set())
+    if unknown:
+        raise ValueError(f"Fields can't be changed: {', '.join(sorted(unknown))}")
+
+    with items_model.transaction():
+        new_version = _claim_version(shop_list_id, version)
+        changed, removed = [], []
+        if action == 'add':
+            name = str(fields.get('name') or '').strip().lower()
+            if not name:
+                raise ValueError("A new item needs a name")
+            ingredient_id = ingredient_ids_for([name]).get(name)
+            # A new item starts unchecked unless the client says otherwise
+            item = {column: _field(column, fields.get(column, 0 if column == 'if_checked' else None))
+                    for column in ITEM_FIELDS}
+            # A custom item keeps its name; ingredient_id must be NULL to satisfy chk_ingredient_or_custom
+            item.update({'ingredient_id': ingredient_id, 'item_name': None if ingredient_id else name})
+            if ingredient_id is None and item['category_id'] is None:
+                item['category_id'] = 0
+            changed = write_items(shop_list_id, [item])
+        else:
+            stored = _stored_item(shop_list_id, item_id)
+            if action == 'remove':
+                items_model.run_query("DELETE FROM Shopping_list_ingredients WHERE id = %s", (item_id,))
+                removed = [item_id]
+            else:
+                if action == 'toggle':
+                    values = {'if_checked': 0 if stored['if_checked'] else 1}
+                else:
+                    values = {column: _field(column, value) for column, value in fields.items()}
+                if values:
+                    set_clause = ', '.join(f"{column} = %s" for column in values)
+                    items_model.run_query(f"UPDATE Shopping_list_ingredients SET {set_clause} WHERE id = %s",
+                                          (*values.values(), item_id))
+                changed = [item_id]
+        list_model.run_query("UPDATE Shopping_list SET version = %s WHERE id = %s", (new_version, shop_list_id))
+        items = list_items(shop_list_id, changed)
+    return {'version': new_version, 'items': items, 'removed': removed}
@@ -0,0 +1,61 @@
+from database.models import BaseModel
+
+items_model = BaseModel('Shopping_list_ingredients')
+
+# One category per ingredient (the lowest id), so several mappings can't fan out the sums
+_CATEGORY = """
+    LEFT JOIN (
+        SELECT ingredient_id, MIN(category_id) AS category_id
+        FROM Ingredients_categories_map
+        GROUP BY ingredient_id
+    ) icm ON icm.ingredient_id = ri.ingredient_id"""
+
+# The consolidation of shopping.consolidate.consolidate_rows, computed by the database:
+# mass and volume amounts summed to grams per ingredient (volume x Ingredients.density)
+# and written as one g/kg line; count units summed per unit name; other (subjective)
+# units kept as a line with measure 0.
+_SNAPSHOT_SQL = """
+    INSERT INTO Shopping_list_ingredients (shop_list_id, ingredient_id, measure, units, category_id)
+    SELECT %s, mass.ingredient_id,
+           IF(mass.grams >= 1000, ROUND(mass.grams / 1000, 2), ROUND(mass.grams, 1)),
+           IF(mass.grams >= 1000, 'kg', 'g'),
+           mass.category_id
+    FROM (
+        SELECT ri.ingredient_id,
+               SUM(ri.measure * u.factor * IF(u.category = 'Volume', i.density, 1)) AS grams,
+               icm.category_id
+        FROM Menu_meals mm
+        JOIN Recipes_ingredients ri ON ri.recipe_id = mm.recipe_id
+        JOIN Units u ON u.id = ri.unit_id
+        JOIN Ingredients i ON i.id = ri.ingredient_id{category}
+        WHERE mm.menu_id IN ({menus}) AND u.category IN ('Mass', 'Volume')
+        GROUP BY ri.ingredient_id, icm.category_id
+    ) mass
+    WHERE mass.grams > 0
+    UNION ALL
+    SELECT %s, ri.ingredient_id,
+           SUM(IF(u.category = 'Count', ri.measure, 0)),
+           LOWER(TRIM(u.name)),
+           icm.category_id
+    FROM Menu_meals mm
+    JOIN Recipes_ingredients ri ON ri.recipe_id = mm.recipe_id
+    JOIN Units u ON u.id = ri.unit_id{category}
+    WHERE mm.menu_id IN ({menus}) AND u.category NOT IN ('Mass', 'Volume')
+    GROUP BY ri.ingredient_id, LOWER(TRIM(u.name)), icm.category_id"""
+
+
+def snapshot_menus(shop_list_id, menu_ids) -> None:
+    """
+    Copy the consolidated ingredients of the given menus into a shopping list with a
+    single INSERT ... SELECT, so the rows never make a round trip through Python.
+    Args:
+        shop_list_id (int): The Shopping_list to fill.
+        menu_ids (list): Menus whose meals are added; a recipe planned twice counts twice.
+    """
+    menu_ids = list(menu_ids)
+    if not menu_ids:
+        return
+    placeholders = ','.join(['%s'] * len(menu_ids))
+    query = _SNAPSHOT_SQL.format(category=_CATEGORY, menus=placeholders)
+    items_model.run_query(query, (shop_list_id, *menu_ids, shop_list_id, *menu_ids))
+
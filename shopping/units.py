@@ -0,0 +1,59 @@
+import threading
+
+from database import cache
+from database.models import BaseModel
+
+units_model = BaseModel('Units')
+ing_model = BaseModel('Ingredients')
+
+_lock = threading.Lock()
+# Built on first use and dropped after writes to their table
+_units = None
+_densities = None
+
+
+def unit_metadata() -> dict:
+    """{lower-cased unit name: {'category', 'factor'}} for every row of Units."""
+    global _units
+    units = _units
+    if units is None:
+        with _lock:
+            if _units is None:
+                rows = units_model.run_query("SELECT name, category, factor FROM Units")
+                units = {row['name'].lower().strip(): {'category': row['category'], 'factor': float(row['factor'])}
+                         for row in rows or []}
+                if rows is not None:
+                    _units = units
+            else:
+                units = _units
+    return units
+
+
+def ingredient_densities() -> dict:
+    """{ingredient_id: density in g/ml} for every ingredient."""
+    global _densities
+    densities = _densities
+    if densities is None:
+        with _lock:
+            if _densities is None:
+                rows = ing_model.run_query("SELECT id, density FROM Ingredients")
+                densities = {row['id']: float(row['density']) for row in rows or [] if row['density'] is not None}
+                if rows is not None:
+                    _densities = densities
+            else:
+                densities = _densities
+    return densities
+
+
+def _forget_units(table_name=None) -> None:
+    global _units
+    _units = None
+
+
+def _forget_densities(table_name=None) -> None:
+    global _densities
+    _densities = None
+
+
+cache.on_invalidate('Units', _forget_units)
+cache.on_invalidate('Ingredients', _forget_densities)